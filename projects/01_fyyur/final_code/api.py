@@ -0,0 +1,255 @@
+"""
+Contains the JSON API (/api/v1) for Venues, Artists and Shows.
+
+  GET /api/v1/<venues|artists|shows>           list, sorted by id (Shows by start_time, id)
+  GET /api/v1/<venues|artists|shows>/<id>      one entity
+
+Query string, all optional:
+  - fields: comma separated names of the returned fields, default all. Only these
+    columns are selected, Shows join Venue and Artist only for their fields.
+  - limit, cursor: size of a list page and the next_cursor of the previous page
+  - start, end: days (YYYY-MM-DD) of the first and last Show of a Show list
+
+Every response carries an ETag, the md5 of the selected columns computed by Postgres
+(of all rows for lists). A request with a matching If-None-Match header fetches only
+these hashes and returns 304, nothing is loaded or serialized.
+"""
+
+import hashlib
+from datetime import datetime, timedelta
+
+import dateutil.parser
+from flask import Blueprint, Response, abort, jsonify, request
+from sqlalchemy import Text, cast, func, tuple_
+from werkzeug.exceptions import HTTPException
+
+from archive import show_source
+from models import Venue, Artist, app, db
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Fields of Venues and Artists: name -> column
+VENUE_FIELDS = {column.key: column for column in (
+    Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.phone,
+    Venue.image_link, Venue.facebook_link, Venue.genres, Venue.seeking_talent,
+    Venue.seeking_description, Venue.latitude, Venue.longitude,
+    Venue.upcoming_shows_count, Venue.past_shows_count
+)}
+ARTIST_FIELDS = {column.key: column for column in (
+    Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone,
+    Artist.image_link, Artist.facebook_link, Artist.genres, Artist.seeking_venue,
+    Artist.seeking_description, Artist.upcoming_shows_count, Artist.past_shows_count
+)}
+
+def show_fields(shows):
+    '''Returns the fields of Shows: name -> column, from Show or show_history()'''
+    return {
+        'id': shows.id,
+        'start_time': shows.start_time,
+        'end_time': shows.end_time,
+        'capacity': shows.capacity,
+        'tickets_sold': shows.tickets_sold,
+        'venue_id': shows.Venue_id,
+        'venue_name': Venue.name,
+        'venue_image_link': Venue.image_link,
+        'artist_id': shows.Artist_id,
+        'artist_name': Artist.name,
+        'artist_image_link': Artist.image_link
+    }
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def selected_fields(fields):
+    '''Reads the "fields" parameter, aborts with 400 for unknown fields
+
+    * Input: <dict> of all fields of the resource
+    * Output: <list> of requested field names, all if the parameter is missing
+    '''
+    value = request.args.get('fields')
+    if not value:
+        return list(fields)
+    names = []
+    for name in value.split(','):
+        name = name.strip()
+        if name not in fields:
+            abort(400, 'Unknown field "{}", expected one of: {}'.format(name, ', '.join(fields)))
+        if name not in names:
+            names.append(name)
+    return names
+
+def page_size():
+    '''Reads the "limit" parameter, defaults to API_PAGE_SIZE'''
+    limit = request.args.get('limit', app.config['API_PAGE_SIZE'], type=int)
+    if not 1 <= limit <= app.config['API_MAX_PAGE_SIZE']:
+        abort(400, 'limit must be between 1 and {}'.format(app.config['API_MAX_PAGE_SIZE']))
+    return limit
+
+def parse_day(name):
+    '''Reads an optional day (YYYY-MM-DD) from the query string'''
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        abort(400, '{} must be a date (YYYY-MM-DD)'.format(name))
+
+def row_hash(columns):
+    '''Returns the md5 of the values of a row, computed by Postgres'''
+    return func.md5(cast(func.json_build_array(*columns), Text))
+
+def not_modified(etag):
+    '''Returns a 304 response if the request has a matching If-None-Match header, otherwise None'''
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def json_response(body, etag):
+    response = jsonify(body)
+    response.set_etag(etag)
+    # Clients may keep the response, but must revalidate it with the ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def list_response(query, fields, names, keys, cursor_of):
+    '''Returns a list page of a resource as JSON or 304
+
+    * Input:
+        - <Query> query: filtered and sorted by the keyset
+        - <dict> fields: all fields of the resource
+        - <list> names: selected field names
+        - <list> keys: names of the keyset fields, selected even if not requested
+        - <function> cursor_of: returns the cursor of a row
+    * Output: <Response> with "data" and "next_cursor"
+    '''
+    per_page = page_size()
+    query = query.limit(per_page + 1)
+    selected = names + [key for key in keys if key not in names]
+    columns = [fields[name].label(name) for name in selected]
+    hashed = row_hash([fields[name] for name in selected])
+    if request.if_none_match:
+        # Rows are only hashed, the same hashes as in the full query below
+        etag = hashlib.md5(''.join(row[0] for row in query.with_entities(hashed)).encode()).hexdigest()
+        response = not_modified(etag)
+        if response is not None:
+            return response
+    rows = query.with_entities(*columns, hashed.label('row_hash')).all()
+    etag = hashlib.md5(''.join(row.row_hash for row in rows).encode()).hexdigest()
+    next_cursor = cursor_of(rows[per_page - 1]) if len(rows) > per_page else None
+    return json_response({
+        'data': [{name: json_value(getattr(row, name)) for name in names} for row in rows[:per_page]],
+        'next_cursor': next_cursor
+    }, etag)
+
+def item_response(query, fields, names):
+    '''Returns one entity as JSON or 304, aborts with 404 if it does not exist'''
+    columns = [fields[name].label(name) for name in names]
+    hashed = row_hash([fields[name] for name in names])
+    if request.if_none_match:
+        etag = query.with_entities(hashed).scalar()
+        if etag is None:
+            abort(404)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+    row = query.with_entities(*columns, hashed.label('row_hash')).first()
+    if row is None:
+        abort(404)
+    return json_response({'data': {name: json_value(getattr(row, name)) for name in names}}, row.row_hash)
+
+@api.errorhandler(HTTPException)
+def api_error(error):
+    '''Returns errors of the API as JSON instead of the HTML error pages'''
+    return jsonify({'error': error.description}), error.code
+
+#----------------------------------------------------------------------------#
+# Venues & Artists.
+#----------------------------------------------------------------------------#
+
+def entity_query(model):
+    # The selected columns replace the entity, see list_response() and item_response()
+    return db.session.query(model.id).select_from(model).order_by(model.id)
+
+@api.route('/<any(venues, artists):kind>')
+def list_entities(kind):
+    '''List Venues or Artists, page by page
+
+    * Input: <string> kind: "venues" or "artists"
+    * Output: JSON with "data" and "next_cursor", the last id of the page
+    '''
+    model, fields = (Venue, VENUE_FIELDS) if kind == 'venues' else (Artist, ARTIST_FIELDS)
+    names = selected_fields(fields)
+    query = entity_query(model)
+    cursor = request.args.get('cursor')
+    if cursor:
+        if not cursor.isdigit():
+            abort(400, 'Invalid cursor')
+        query = query.filter(model.id > int(cursor))
+    return list_response(query, fields, names, ['id'], lambda row: str(row.id))
+
+@api.route('/<any(venues, artists):kind>/<int:entity_id>')
+def get_entity(kind, entity_id):
+    '''Get one Venue or Artist
+
+    * Input:
+        - <string> kind: "venues" or "artists"
+        - <int> entity_id
+    '''
+    model, fields = (Venue, VENUE_FIELDS) if kind == 'venues' else (Artist, ARTIST_FIELDS)
+    names = selected_fields(fields)
+    return item_response(entity_query(model).filter(model.id == entity_id), fields, names)
+
+#----------------------------------------------------------------------------#
+# Shows.
+#----------------------------------------------------------------------------#
+
+def show_query(shows, names):
+    '''Returns the query of Shows, joined with Venue and Artist only for their selected fields'''
+    query = db.session.query(shows.id).select_from(shows).order_by(shows.start_time, shows.id)
+    if any(name.startswith('venue_') and name != 'venue_id' for name in names):
+        query = query.join(Venue, Venue.id == shows.Venue_id)
+    if any(name.startswith('artist_') and name != 'artist_id' for name in names):
+        query = query.join(Artist, Artist.id == shows.Artist_id)
+    return query
+
+@api.route('/shows')
+def list_shows():
+    '''List Shows, page by page
+
+    * Output: JSON with "data" and "next_cursor", the (start_time, id) of the last Show of the page
+    '''
+    start = parse_day('start')
+    end = parse_day('end')
+    # Windows that start before the archive horizon read archived Shows as well
+    shows = show_source(start)
+    fields = show_fields(shows)
+    names = selected_fields(fields)
+    query = show_query(shows, names)
+    if start:
+        query = query.filter(shows.start_time >= start)
+    if end:
+        query = query.filter(shows.start_time < end + timedelta(days=1))
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            start_time, show_id = cursor.rsplit('_', 1)
+            query = query.filter(tuple_(shows.start_time, shows.id) > tuple_(dateutil.parser.parse(start_time), int(show_id)))
+        except (ValueError, OverflowError):
+            abort(400, 'Invalid cursor')
+    return list_response(query, fields, names, ['start_time', 'id'],
+        lambda row: '{}_{}'.format(row.start_time.isoformat(), row.id))
+
+@api.route('/shows/<int:show_id>')
+def get_show(show_id):
+    '''Get one Show, archived Shows included'''
+    shows = show_source()
+    fields = show_fields(shows)
+    names = selected_fields(fields)
+    return item_response(show_query(shows, names).filter(shows.id == show_id), fields, names)
@@ -8,16 +8,36 @@ Also runs the application.
 #----------------------------------------------------------------------------#
 
 import json
+import math
 import dateutil.parser
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
-from sqlalchemy import func, inspect
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, stream_with_context, session, g, has_request_context
+from sqlalchemy import func, inspect, tuple_, cast, or_, select, union, union_all, literal, null, true, String, Integer, DateTime
+from sqlalchemy.dialects.postgresql import aggregate_order_by, ARRAY
+from sqlalchemy.exc import IntegrityError
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
-from models import Venue, Show, Artist, app, db
+from models import Venue, Show, Artist, app, db, SHOW_OVERLAP_CONSTRAINTS
+import counters # Registers the listeners that keep the Show counters up to date and their CLI commands
+import bulk_import # Registers the "flask import-catalog" CLI command
+import tickets # Registers the "flask release-expired-holds" CLI command
+from archive import show_history, show_source # Also registers the "flask archive-shows" CLI command
+from stats import get_stats, add_months # Also registers the listeners that maintain the Show rollup and its CLI command
+import similar # Registers the listeners that mark changed Artists and the "flask compute-similar-artists" CLI command
+from export import export_query, csv_chunks, ndjson_chunks
+import seed # Registers the "flask seed-catalog" CLI command
+from cache import fragment_cache, page_cache
+from typeahead import venue_index, artist_index
+from instrumentation import init_instrumentation
+from template_cache import init_template_cache
+import date_format
+from api import api
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_moment import Moment
@@ -26,6 +46,11 @@ from config import SQLALCHEMY_DATABASE_URI # Import local database URI from Conf
 
 # TODO DONE: connect to a local postgresql database. SEE Models.py
 
+# Count queries & database time per request and report likely N+1 patterns (see config.py)
+init_instrumentation(app, db)
+# JSON API for Venues, Artists and Shows under /api/v1 (see api.py)
+app.register_blueprint(api)
+
 #----------------------------------------------------------------------------#
 # Custom Functions.
 #----------------------------------------------------------------------------#
@@ -61,32 +86,639 @@ def get_dict_list_from_result(result):
       list_dict.append(i_dict)
   return list_dict
 
+def aggregate_shows(shows, partner, partner_label, condition):
+  '''Aggregates Shows into a JSON list within the database
+
+  * Input:
+      - shows: Show or show_history()
+      - <Model> partner: the other side of the Show (Artist for a Venue and vice versa)
+      - <string> partner_label: prefix of the keys in the list ("artist" or "venue")
+      - <BinaryExpression> condition: only Shows matching the condition are aggregated
+  * Output: <FunctionFilter> json_agg expression, sorted by start_time
+
+  Each list element has the keys "<partner_label>_id", "<partner_label>_name",
+  "<partner_label>_image_link" and "start_time", which is what the templates expect.
+
+  Used in following Views:
+    - /venues/<int:venue_id>
+    - /artists/<int:artist_id>
+  '''
+  return func.json_agg(aggregate_order_by(
+    func.json_build_object(
+      partner_label + '_id', partner.id,
+      partner_label + '_name', partner.name,
+      partner_label + '_image_link', partner.image_link,
+      'start_time', shows.start_time),
+    shows.start_time)).filter(condition)
+
+def parse_show_list(shows):
+  '''Converts a list of Shows aggregated by aggregate_shows back to Python values
+
+  * Input: <list> of dicts or None (json_agg returns NULL if no Show matched)
+  * Output: <list> of dicts with "start_time" as datetime
+  '''
+  shows = shows or []
+  for show in shows:
+    show['start_time'] = dateutil.parser.parse(show['start_time'])
+  return shows
+
+def shows_of(entity, entity_fk, shows, partner, partner_fk, partner_label, condition, name):
+  '''Aggregates the Shows of an entity matching a condition into one row
+
+  * Input:
+      - <Model> entity: Venue or Artist, of the outer query
+      - <Column> entity_fk, partner_fk: Show columns referencing the entity and the partner
+      - shows: Show or show_history()
+      - partner, partner_label, condition: see aggregate_shows()
+      - <string> name: name of the subquery
+  * Output: LATERAL subquery with the columns "shows" (list) and "count"
+
+  Used in following Views:
+    - /venues/<int:venue_id>
+    - /artists/<int:artist_id>
+  '''
+  entity_fk = getattr(shows, entity_fk.key)
+  partner_fk = getattr(shows, partner_fk.key)
+  return (db.session.query(
+    aggregate_shows(shows, partner, partner_label, condition).label('shows'),
+    func.count(shows.start_time).label('count'))
+    .select_from(shows)
+    .outerjoin(partner, partner.id == partner_fk)
+    .filter(entity_fk == entity.id, condition)
+    .statement.lateral(name))
+
+def get_detail_page(entity, entity_fk, partner, partner_fk, partner_label, entity_id):
+  '''Gets a Venue or Artist with its past & upcoming Shows in one single query
+
+  * Input:
+      - <Model> entity: Venue or Artist
+      - <Column> entity_fk: Show column referencing the entity
+      - <Model> partner: Artist or Venue
+      - <Column> partner_fk: Show column referencing the partner
+      - <string> partner_label: "artist" or "venue"
+      - <int> entity_id
+  * Output: <dict> with all entity columns plus "past_shows", "upcoming_shows",
+      "past_shows_count" and "upcoming_shows_count", or None if the entity does not exist
+
+  Only Shows of the requested entity are read, so the cost of the query depends
+  on the number of Shows of this entity and not on the size of the Show table.
+  Past and upcoming Shows are aggregated in two LATERAL subqueries: past Shows
+  include the archived ones, upcoming Shows are never archived and are read from
+  Show alone.
+
+  Used in following Views:
+    - /venues/<int:venue_id>
+    - /artists/<int:artist_id>
+  '''
+  now = datetime.now()
+  history = show_history()
+  past = shows_of(entity, entity_fk, history, partner, partner_fk, partner_label,
+    history.start_time <= now, 'past')
+  upcoming = shows_of(entity, entity_fk, Show, partner, partner_fk, partner_label,
+    Show.start_time > now, 'upcoming')
+
+  row = (db.session.query(
+    *entity.__table__.columns,
+    past.c.shows.label('past_shows'),
+    upcoming.c.shows.label('upcoming_shows'),
+    past.c.count.label('past_shows_count'),
+    upcoming.c.count.label('upcoming_shows_count'))
+    .select_from(entity)
+    .join(past, true())
+    .join(upcoming, true())
+    .filter(entity.id == entity_id)
+    .first())
+
+  if row is None:
+    return None
+  detail = row._asdict()
+  detail['past_shows'] = parse_show_list(detail['past_shows'])
+  detail['upcoming_shows'] = parse_show_list(detail['upcoming_shows'])
+  return detail
+
+def get_artist_page(artist_id):
+  '''Gets an Artist with its past & upcoming Shows and the Artists you might also like
+
+  * Input: <int> artist_id
+  * Output: <dict> of get_detail_page() plus "similar_artists", or None if the Artist does not exist
+
+  Similar Artists are precomputed by similar.py, reading them is one index scan.
+  Changes show up once the job has run and the cached page has expired (PAGE_CACHE_TTL).
+
+  Used in following Views:
+    - /artists/<int:artist_id>
+  '''
+  detail = get_detail_page(Artist, Show.Artist_id, Venue, Show.Venue_id, 'venue', artist_id)
+  if detail is not None:
+    detail['similar_artists'] = [row._asdict() for row in similar.get_similar_artists(artist_id)]
+  return detail
+
+def escape_like(term):
+  '''Escapes the wildcards of a LIKE pattern, so a search term is matched literally
+
+  * Input: <string> term
+  * Output: <string> term with "\\", "%" and "_" escaped by a backslash
+  '''
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def ranked_search(model, search_term, page):
+  '''Searches names of Venues or Artists, ranked by relevance and paginated
+
+  * Input:
+      - <Model> model: Venue or Artist
+      - <string> search_term
+      - <int> page: 1-based page number
+  * Output: <dict> with "count", "data", "page" and "pages"
+
+  The partial, case-insensitive match (ILIKE) is served by the trigram index on "name".
+  Results are ranked by trigram similarity; the total number of matches is computed
+  by a window function, so the total and the page come back from one single query.
+  Only a page past the end needs a second query for the total.
+
+  Used in following Views:
+    - /venues/search
+    - /artists/search
+  '''
+  per_page = app.config['SEARCH_PAGE_SIZE']
+  matches = model.name.ilike('%{}%'.format(escape_like(search_term)), escape='\\')
+  rows = (db.session.query(
+    model.id,
+    model.name,
+    func.count().over().label('total'))
+    .filter(matches)
+    .order_by(
+      func.word_similarity(search_term, model.name).desc(),
+      func.similarity(model.name, search_term).desc(),
+      model.name,
+      model.id)
+    .limit(per_page)
+    .offset((page - 1) * per_page)
+    .all())
+
+  if rows:
+    total = rows[0].total
+  elif page > 1:
+    # A page past the end (e.g. a stale "Next" button) has no row to carry the total, count on its own
+    total = db.session.query(func.count(model.id)).filter(matches).scalar()
+  else:
+    total = 0
+  return {
+    "count": total,
+    "data": rows,
+    "page": page,
+    "pages": -(-total // per_page) # ceil division
+  }
+
+def name_match(name, search_term):
+  '''Returns the trigram ranks of a name and the 1-based position of the search term in it (0 if missing)'''
+  return (
+    func.word_similarity(search_term, name),
+    func.similarity(name, search_term),
+    func.strpos(func.lower(name), search_term.lower()))
+
+def unified_search(search_term, per_type):
+  '''Searches Venues, Artists and upcoming Shows in one single query
+
+  * Input:
+      - <string> search_term
+      - <int> per_type: maximum number of results per type
+  * Output: <dict> "venues", "artists" and "shows" -> <dict> with "count" (all matches)
+    and "data" (the best per_type matches)
+
+  Venues and Artists match by name, served by the trigram indexes like ranked_search().
+  Shows match if the name of their Artist or Venue matches; they are looked up through
+  the matched Artists & Venues and the indexes on (Artist_id / Venue_id, start_time).
+  All matches are ranked by trigram similarity in one UNION ALL, row_number() caps
+  every type and count() over the type returns the number of all matches.
+  Every row carries the position of the search term in its name(s), for the highlight.
+
+  Used in following Views:
+    - /search
+  '''
+  pattern = '%{}%'.format(escape_like(search_term))
+  matches = []
+  for kind, model in (('venue', Venue), ('artist', Artist)):
+    word_rank, rank, position = name_match(model.name, search_term)
+    matches.append(select([
+      literal(kind, String).label('kind'),
+      model.id.label('id'),
+      model.name.label('name'),
+      position.label('name_match'),
+      cast(null(), Integer).label('venue_id'),
+      cast(null(), String).label('venue_name'),
+      cast(null(), Integer).label('venue_match'),
+      cast(null(), DateTime).label('start_time'),
+      word_rank.label('word_rank'),
+      rank.label('rank')])
+      .where(model.name.ilike(pattern, escape='\\')))
+  venues, artists = [match.cte('matched_{}s'.format(kind)) for kind, match in zip(('venue', 'artist'), matches)]
+
+  # Upcoming Shows of matched Artists or Venues, each Show once
+  upcoming = Show.start_time > datetime.now()
+  shows = union(
+    select([Show.id]).where(Show.Artist_id.in_(select([artists.c.id]))).where(upcoming),
+    select([Show.id]).where(Show.Venue_id.in_(select([venues.c.id]))).where(upcoming)).alias('matched_shows')
+  artist_word_rank, artist_rank, artist_position = name_match(Artist.name, search_term)
+  venue_word_rank, venue_rank, venue_position = name_match(Venue.name, search_term)
+  # The id and name of a Show row are those of its Artist, the Show page is the Artist page
+  show_rows = (select([
+    literal('show', String).label('kind'),
+    Artist.id.label('id'),
+    Artist.name.label('name'),
+    artist_position.label('name_match'),
+    Venue.id.label('venue_id'),
+    Venue.name.label('venue_name'),
+    venue_position.label('venue_match'),
+    Show.start_time,
+    func.greatest(artist_word_rank, venue_word_rank).label('word_rank'),
+    func.greatest(artist_rank, venue_rank).label('rank')])
+    .select_from(shows
+      .join(Show, Show.id == shows.c.id)
+      .join(Artist, Artist.id == Show.Artist_id)
+      .join(Venue, Venue.id == Show.Venue_id)))
+
+  found = union_all(select([venues]), select([artists]), show_rows).alias('found')
+  ranked = select([
+    found,
+    func.row_number().over(
+      partition_by=found.c.kind,
+      order_by=(found.c.word_rank.desc(), found.c.rank.desc(), found.c.start_time, found.c.name, found.c.id)).label('position'),
+    func.count().over(partition_by=found.c.kind).label('total')]).alias('ranked')
+  rows = db.session.execute(select([ranked])
+    .where(ranked.c.position <= per_type)
+    .order_by(ranked.c.kind, ranked.c.position))
+
+  results = {kind: {'count': 0, 'data': []} for kind in ('venues', 'artists', 'shows')}
+  for row in rows:
+    result = results[row.kind + 's']
+    result['count'] = row.total
+    result['data'].append(row)
+  return results
+
+def stream_template(template_name, **context):
+  '''Renders a template piece by piece instead of into one big string
+
+  * Input:
+      - <string> template_name
+      - context: template variables, like render_template
+  * Output: <TemplateStream>, to be wrapped into stream_with_context and a Response
+
+  The first bytes are sent before the whole page has been rendered,
+  memory only holds the current buffer and not the complete page.
+
+  Used in following Views:
+    - /shows
+  '''
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  stream.enable_buffering(20) # Send the page in chunks of 20 template events, not event by event
+  return stream
+
+def encode_cursor(sort_value, row_id):
+  '''Encodes the sort key (sort value, id) of the last row of a page as URL parameter'''
+  return '{}_{}'.format(sort_value, row_id)
+
+def decode_cursor(cursor, parse=str):
+  '''Decodes a cursor created by encode_cursor
+
+  * Input:
+      - <string> cursor
+      - <function> parse: converts the sort value back, e.g. into a datetime
+  * Output: <tuple> (sort value, id), aborts with 400 for invalid cursors
+  '''
+  try:
+    sort_value, row_id = cursor.rsplit('_', 1)
+    return parse(sort_value), int(row_id)
+  except (ValueError, OverflowError):
+    abort(400)
+
+class KeysetPage:
+  '''One page of rows sorted by (sort value, id)
+
+  * Input:
+      - <Query> query: sorted by the sort value and id
+      - <int> per_page
+      - <function> sort_value: returns the sort value of a row as string, used for the cursor
+
+  Iterating the page yields at most per_page rows. One more row is fetched to find out
+  if there is a next page; after the iteration "next_cursor" points behind the last row,
+  or is None on the last page. The template can therefore link to the next page at its end,
+  even while rendering is streamed.
+
+  Used in following Views:
+    - /shows
+    - /artists
+  '''
+  def __init__(self, query, per_page, sort_value):
+    self.query = query.limit(per_page + 1)
+    self.per_page = per_page
+    self.sort_value = sort_value
+    self.next_cursor = None
+
+  def __iter__(self):
+    last = None
+    for position, row in enumerate(self.query):
+      if position == self.per_page:
+        self.next_cursor = encode_cursor(self.sort_value(last), last.id)
+        break
+      last = row
+      yield row
+
+def parse_date_arg(name):
+  '''Reads an optional date (YYYY-MM-DD) from the query string, aborts with 400 if it is invalid'''
+  value = request.args.get(name)
+  if not value:
+    return None
+  try:
+    return datetime.strptime(value, '%Y-%m-%d')
+  except ValueError:
+    abort(400)
+
+def parse_month_arg(name):
+  '''Reads an optional month (YYYY-MM) from the query string as its first day, aborts with 400 if it is invalid'''
+  value = request.args.get(name)
+  if not value:
+    return None
+  try:
+    return datetime.strptime(value, '%Y-%m').date()
+  except ValueError:
+    abort(400)
+
+def selected_genres():
+  '''Reads the selected genres from the query string (?genre=Jazz&genre=Blues), without duplicates'''
+  genres = []
+  for genre in request.args.getlist('genre'):
+    genre = genre.strip()
+    if genre and genre not in genres:
+      genres.append(genre)
+  return genres
+
+def genre_condition(model, genres):
+  '''Matches Venues or Artists that have all given genres, served by the GIN index on genres'''
+  # psycopg2 sends a list as text[], which has no @> operator with the varchar[] column
+  return model.genres.op('@>')(cast(genres, ARRAY(db.String())))
+
+def genre_facets(model, genres):
+  '''Counts Venues or Artists per genre with one aggregate query
+
+  * Input:
+      - <Model> model: Venue or Artist
+      - <list> genres: selected genres, only entities that have all of them are counted
+  * Output: <list> of dicts with "genre", "count", "selected" and "toggle", the
+    genres to select when the facet is clicked
+
+  The count of a genre is the number of results after adding it to the selection.
+
+  Used in following Views:
+    - /venues
+    - /artists
+  '''
+  query = db.session.query(func.unnest(model.genres).label('genre'))
+  if genres:
+    query = query.filter(genre_condition(model, genres))
+  unnested = query.subquery()
+  rows = (db.session.query(
+    unnested.c.genre,
+    func.count().label('count'))
+    .group_by(unnested.c.genre)
+    .order_by(unnested.c.genre)
+    .all())
+  return [{
+    'genre': row.genre,
+    'count': row.count,
+    'selected': row.genre in genres,
+    'toggle': [genre for genre in genres if genre != row.genre] if row.genre in genres else genres + [row.genre]
+  } for row in rows]
+
+# Mean radius of the earth, used by the distance calculation of /venues/near
+EARTH_RADIUS_KM = 6371.0
+
+def bounding_box(latitude, longitude, radius_km):
+  '''Returns the box of coordinates that contains a circle around a point
+
+  * Input: <float> latitude, longitude in degrees, <float> radius_km
+  * Output: ((min latitude, max latitude), <list> of (min longitude, max longitude)),
+    there are two longitude ranges if the box crosses the dateline
+
+  Every point within the circle is inside the box, but not every point in the box within the circle.
+  '''
+  angle = radius_km / EARTH_RADIUS_KM
+  min_latitude = latitude - math.degrees(angle)
+  max_latitude = latitude + math.degrees(angle)
+  if min_latitude <= -90 or max_latitude >= 90:
+    # The circle contains a pole, so it contains every longitude
+    return (max(min_latitude, -90), min(max_latitude, 90)), [(-180, 180)]
+
+  delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+  min_longitude = longitude - delta
+  max_longitude = longitude + delta
+  if min_longitude < -180:
+    return (min_latitude, max_latitude), [(min_longitude + 360, 180), (-180, max_longitude)]
+  if max_longitude > 180:
+    return (min_latitude, max_latitude), [(min_longitude, 180), (-180, max_longitude - 360)]
+  return (min_latitude, max_latitude), [(min_longitude, max_longitude)]
+
+def distance_km(latitude, longitude):
+  '''SQL expression of the great-circle distance (haversine) between Venues and a point in km'''
+  a = (func.power(func.sin(func.radians(Venue.latitude - latitude) / 2), 2)
+    + math.cos(math.radians(latitude)) * func.cos(func.radians(Venue.latitude))
+    * func.power(func.sin(func.radians(Venue.longitude - longitude) / 2), 2))
+  # least() guards asin against rounding errors slightly above 1
+  return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(func.least(a, 1.0)))
+
+def venues_near(latitude, longitude, radius_km, limit):
+  '''Returns Venues within a radius around a point, sorted by distance
+
+  * Input:
+      - <float> latitude, longitude in degrees
+      - <float> radius_km
+      - <int> limit: maximum number of Venues
+  * Output: <list> of rows with id, name, city, state, address, latitude, longitude and distance_km
+
+  Only Venues inside the bounding box of the circle are read, through the index
+  on (latitude, longitude). The exact distance is only calculated for them.
+
+  Used in following Views:
+    - /venues/near
+  '''
+  (min_latitude, max_latitude), longitude_ranges = bounding_box(latitude, longitude, radius_km)
+  candidates = (db.session.query(
+    Venue.id,
+    Venue.name,
+    Venue.city,
+    Venue.state,
+    Venue.address,
+    Venue.latitude,
+    Venue.longitude,
+    distance_km(latitude, longitude).label('distance_km'))
+    .filter(
+      Venue.latitude.between(min_latitude, max_latitude),
+      or_(*[Venue.longitude.between(low, high) for low, high in longitude_ranges]))
+    .subquery())
+  return (db.session.query(candidates)
+    .filter(candidates.c.distance_km <= radius_km)
+    .order_by(candidates.c.distance_km, candidates.c.id)
+    .limit(limit)
+    .all())
+
+def parse_float_arg(name, minimum, maximum, default=None):
+  '''Reads a number from the query string, aborts with 400 if it is missing, invalid or out of range'''
+  value = request.args.get(name)
+  if value is None or value == '':
+    if default is None:
+      abort(400)
+    return default
+  try:
+    value = float(value)
+  except ValueError:
+    abort(400)
+  if not minimum <= value <= maximum:
+    abort(400)
+  return value
+
+def default_end_time(start_time):
+  '''Returns the end of a Show that has no end time'''
+  return start_time + timedelta(hours=app.config['SHOW_DEFAULT_DURATION_HOURS'])
+
+def booking_conflict(error):
+  '''Returns a message if an IntegrityError was raised by a double booking, otherwise None
+
+  The exclusion constraints on Show raise exclusion_violation (SQLSTATE 23P01), the name
+  of the violated constraint tells whether the Venue or the Artist is double booked.
+
+  Used in following Views:
+    - /shows/create
+  '''
+  orig = error.orig
+  if getattr(orig, 'pgcode', None) != '23P01':
+    return None
+  booked = SHOW_OVERLAP_CONSTRAINTS.get(orig.diag.constraint_name, 'Venue or Artist')
+  return 'The {} is already booked for a Show that overlaps this time.'.format(booked)
+
+# Keys of the cached fragments on the homepage
+RECENT_ARTISTS = 'home:recent_artists'
+RECENT_VENUES = 'home:recent_venues'
+
+def render_home(**context):
+  '''Renders the homepage with the cached fragments of recently listed Artists & Venues
+
+  * Input: context: additional template variables, e.g. flashType
+  * Output: <string> rendered homepage
+
+  Fragments are only rendered (and queried) on a cache miss, they are invalidated
+  by the views that create, edit or delete Artists and Venues.
+
+  Used in following Views:
+    - /
+    - /venues/create
+    - /artists/create
+    - /shows/create
+  '''
+  recent_artists = fragment_cache.get_or_render(RECENT_ARTISTS, lambda: Markup(render_template(
+    'pages/recent_artists.html',
+    artists=db.session.query(Artist.id, Artist.name).order_by(Artist.id.desc()).limit(10).all())))
+  recent_venues = fragment_cache.get_or_render(RECENT_VENUES, lambda: Markup(render_template(
+    'pages/recent_venues.html',
+    venues=db.session.query(Venue.id, Venue.name).order_by(Venue.id.desc()).limit(10).all())))
+  return render_template('pages/home.html', recent_artists=recent_artists, recent_venues=recent_venues, **context)
+
+def next_show_start(detail):
+  '''Returns the start of the next upcoming Show of a detail page, or None
+
+  Once this Show has started, it belongs to the past Shows and a cached page is outdated.
+  '''
+  upcoming_shows = detail['upcoming_shows']
+  return upcoming_shows[0]['start_time'] if upcoming_shows else None
+
+def render_detail_page(kind, entity_id, load, template_name):
+  '''Renders the detail page of a Venue or Artist, served from the page cache if possible
+
+  * Input:
+      - <string> kind: "venue" or "artist", also the template variable name
+      - <int> entity_id
+      - <function> load: returns the detail dict of the entity, or None
+      - <string> template_name
+  * Output: <string> rendered page, aborts with 404 for unknown ids
+
+  The cache is bypassed while flash messages are pending, they are part of the page
+  but meant for one user only.
+
+  Used in following Views:
+    - /venues/<int:venue_id>
+    - /artists/<int:artist_id>
+  '''
+  cacheable = '_flashes' not in session
+  # Dates on the page are formatted in the locale of the request
+  locale = get_locale()
+  if cacheable:
+    page = page_cache.get(kind, entity_id, locale)
+    if page is not None:
+      return page
+
+  # Read the version before the data, a change in between must not be cached under it
+  version = page_cache.version(kind, entity_id)
+  detail = load()
+  if detail is None:
+    abort(404)
+  page = render_template(template_name, **{kind: detail})
+  if cacheable:
+    page_cache.set(kind, entity_id, version, page, expires_at=next_show_start(detail), variant=locale)
+  return page
+
+def invalidate_venue_pages(venue_id):
+  '''Bumps the cached page of a Venue and of every Artist that has a Show there'''
+  page_cache.bump('venue', venue_id)
+  shows = show_history()
+  for (artist_id,) in db.session.query(shows.Artist_id).filter(shows.Venue_id == venue_id).distinct():
+    page_cache.bump('artist', artist_id)
+
+def invalidate_artist_pages(artist_id):
+  '''Bumps the cached page of an Artist and of every Venue where the Artist has a Show'''
+  page_cache.bump('artist', artist_id)
+  shows = show_history()
+  for (venue_id,) in db.session.query(shows.Venue_id).filter(shows.Artist_id == artist_id).distinct():
+    page_cache.bump('venue', venue_id)
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+def get_locale():
+  '''Returns the locale of the current request
+
+  The best match of the Accept-Language header among LANGUAGES,
+  the first of LANGUAGES outside of requests or if nothing matches.
+  '''
+  default = app.config['LANGUAGES'][0]
+  if not has_request_context():
+    return default
+  if 'locale' not in g:
+    g.locale = request.accept_languages.best_match(app.config['LANGUAGES']) or default
+  return g.locale
+
 def format_datetime(value, format='medium'):
   '''Converts datetime to local datetime of User
 
   * Input: 
       - <datetime> value
-      - <string> format
+      - <string> format: "full", "medium" or a babel pattern
   * Output: 
-      - <datetime> datetime value of user timezone
+      - <string> formatted in the locale of the request
 
   Source: http://babel.pocoo.org/en/latest/api/dates.html
 
-  Only used for flask filter register.
+  Only used for flask filter register. Patterns, locales and formatted values are cached by date_format.py.
   '''
   # Instead of parsing a string, I directly parse a datetime object, so I changed this function.
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(value, format)
+  return date_format.format_datetime(value, format, get_locale())
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+# Load compiled templates from the bytecode cache, optionally warm them up (see config.py).
+# Templates are compiled against the registered filters, so this comes after all of them.
+init_template_cache(app)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -105,10 +737,8 @@ def index():
   Corresponding HTML:
     - templates/pages/home.html
   '''
-  # Bonus: List recently listed Artists & Venues
-  recent_artists = Artist.query.order_by(Artist.id.desc()).limit(10).all()
-  recent_venues = Venue.query.order_by(Venue.id.desc()).limit(10).all()
-  return render_template('pages/home.html', recent_artists = recent_artists, recent_venues = recent_venues)
+  # Bonus: List recently listed Artists & Venues, served from the fragment cache
+  return render_home()
 
 
 #  Venues
@@ -118,12 +748,14 @@ def index():
 def venues():
   '''List all Venues
   
-  * Input: None
+  * Input (query string, optional):
+    - <string> genre: only Venues with this genre, can be repeated
 
   Contains following features:
     - See all Venues listed
     - Grouped by City and State
     - See number of upcoming Shows
+    - Narrow Venues down by genres, see how many Venues each genre has
     - Clicking on a Venue links to its detail page under "/venues/<int:venue_id>"
   
   Corresponding HTML:
@@ -132,30 +764,52 @@ def venues():
   # TODO DONE: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
   
-  # Step 1: Get a list of dicts that contains City & State names
-  groupby_venues_result = (db.session.query(
-                Venue.city,
-                Venue.state
-                )
-        .group_by(
-                Venue.city,
-                Venue.state
-                )
-  )
-  data=get_dict_list_from_result(groupby_venues_result)
-
-  # Step 2: Loop through areas and append Venue data
-  for area in data:
-    # This will add a new key to the dictionary called "venues".
-    # It gets filled with a list of venues that are in the same city-
-    area['venues'] = [object_as_dict(ven) for ven in Venue.query.filter_by(city = area['city']).all()]
-    # Step 3: Append num_shows
-    for ven in area['venues']:
-      # This will add a new subkey to the dictionarykey "venues" called "num_shows".
-      # It gets filled with a number that counts how many upcoming shows the venue has.
-      ven['num_shows'] = db.session.query(func.count(Show.c.Venue_id)).filter(Show.c.Venue_id == ven['id']).filter(Show.c.start_time > datetime.now()).all()[0][0]
- 
-  return render_template('pages/venues.html', areas=data)
+  # Step 1: Get every Venue with its number of upcoming Shows in one single query.
+  # The number is read from the counter column maintained by counters.py, so the Show table is not touched.
+  # Rows are sorted by State & City, so they can be grouped without asking the database again.
+  # Selected genres are matched by the GIN index on genres.
+  genres = selected_genres()
+  query = (db.session.query(
+    Venue.id,
+    Venue.name,
+    Venue.city,
+    Venue.state,
+    Venue.upcoming_shows_count.label('num_shows'))
+    .order_by(Venue.state, Venue.city, Venue.name))
+  if genres:
+    query = query.filter(genre_condition(Venue, genres))
+  venue_rows = query.all()
+
+  # Step 2: Group Venues into areas. An area is identified by City AND State,
+  # so two cities with the same name in different states stay separated.
+  data = []
+  for (city, state), area_venues in groupby(get_dict_list_from_result(venue_rows), key=itemgetter('city', 'state')):
+    data.append({
+      'city': city,
+      'state': state,
+      'venues': list(area_venues)
+    })
+
+  return render_template('pages/venues.html', areas=data, facets=genre_facets(Venue, genres), genres=genres)
+
+@app.route('/search')
+def search():
+  '''Search for Venues, Artists and upcoming Shows at once
+
+  * Input (query string): <string> q: search term
+
+  Contains following features:
+    - Finds Venues and Artists by name, and upcoming Shows by the name of their Artist or Venue
+    - Shows the best SEARCH_RESULTS_PER_TYPE results per type, the matched part highlighted,
+      and how many results of each type there are
+    - One database round trip per search
+
+  Corresponding HTML:
+    - templates/pages/search.html
+  '''
+  search_term = request.args.get('q', '').strip()
+  results = unified_search(search_term, app.config['SEARCH_RESULTS_PER_TYPE']) if search_term else None
+  return render_template('pages/search.html', results=results, search_term=search_term)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
@@ -178,23 +832,45 @@ def search_venues():
   # get search term from request
   search_term=request.form.get('search_term', '').lower() 
 
-  # use search term to count, how many occurance can be find in database
-  search_venues_count = (db.session.query(
-    func.count(Venue.id))
-    .filter(func.lower(Venue.name).contains(search_term))
-    .all())
-
-  # use search term to find all Venue records in database
-  search_venues_result = Venue.query.filter(func.lower(Venue.name).contains(search_term)).all()
+  # get requested page from request, the first page is the default
+  page = max(request.form.get('page', 1, type=int), 1)
 
-  # create a well formatted response with above results
-  response={
-    "count": search_venues_count[0][0],
-    "data": search_venues_result
-  }
+  # use search term to get the total number of matches and the requested page of results
+  response = ranked_search(Venue, search_term, page)
 
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
+@app.route('/venues/near')
+def venues_near_point():
+  '''Find Venues near a point
+
+  * Input (query string):
+    - <float> lat, lng: the point in degrees
+    - <float> radius_km: optional, defaults to NEAR_DEFAULT_RADIUS_KM, at most NEAR_MAX_RADIUS_KM
+  * Output: JSON with the Venues within the radius, nearest first, at most NEAR_MAX_RESULTS
+
+  Venues without coordinates are never returned.
+  '''
+  latitude = parse_float_arg('lat', -90, 90)
+  longitude = parse_float_arg('lng', -180, 180)
+  radius_km = parse_float_arg('radius_km', 0, app.config['NEAR_MAX_RADIUS_KM'], app.config['NEAR_DEFAULT_RADIUS_KM'])
+
+  venues = [{
+    'id': venue.id,
+    'name': venue.name,
+    'city': venue.city,
+    'state': venue.state,
+    'address': venue.address,
+    'latitude': venue.latitude,
+    'longitude': venue.longitude,
+    'distance_km': round(venue.distance_km, 3)
+  } for venue in venues_near(latitude, longitude, radius_km, app.config['NEAR_MAX_RESULTS'])]
+  return jsonify({
+    'count': len(venues),
+    'radius_km': radius_km,
+    'venues': venues
+  })
+
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   '''See venues detail page
@@ -212,46 +888,11 @@ def show_venue(venue_id):
   '''
   # TODO DONE: replace with real venue data from the venues table, using venue_id
   
-  # Step 1: Get single Venue
-  single_venue = Venue.query.get(venue_id)
-
-  # Step 2: Get Past Shows
-  single_venue.past_shows = (db.session.query(
-    Artist.id.label("artist_id"), 
-    Artist.name.label("artist_name"), 
-    Artist.image_link.label("artist_image_link"), 
-    Show)
-    .join(Venue)
-    .join(Artist)
-    .filter(Show.c.start_time <= datetime.now())
-    .all())
-  
-  # Step 3: Get Upcomming Shows
-  single_venue.upcoming_shows = (db.session.query(
-    Artist.id.label("artist_id"), 
-    Artist.name.label("artist_name"), 
-    Artist.image_link.label("artist_image_link"), 
-    Show)
-    .join(Venue)
-    .join(Artist)
-    .filter(Show.c.start_time > datetime.now())
-    .all())
-
-  # Step 4: Get Number of past Shows
-  single_venue.past_shows_count = (db.session.query(
-    func.count(Show.c.Venue_id))
-    .join(Venue)
-    .filter(Show.c.start_time < datetime.now())
-    .all())[0][0]
-
-  # Step 5: Get Number of Upcoming Shows
-  single_venue.upcoming_shows_count = (db.session.query(
-    func.count(Show.c.Venue_id))
-    .join(Venue)
-    .filter(Show.c.start_time > datetime.now())
-    .all())[0][0]
-
-  return render_template('pages/show_venue.html', venue=single_venue)
+  # Serve the page from the page cache. On a miss, get the Venue with its past & upcoming Shows
+  # and their counts in one single query
+  return render_detail_page('venue', venue_id,
+    lambda: get_detail_page(Venue, Show.Venue_id, Artist, Show.Artist_id, 'artist', venue_id),
+    'pages/show_venue.html')
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -296,10 +937,14 @@ def create_venue_submission():
         address = request.form['address'],
         phone = request.form['phone'],
         genres = request.form.getlist('genres'),
-        facebook_link = request.form['facebook_link']
+        facebook_link = request.form['facebook_link'],
+        latitude = form.latitude.data,
+        longitude = form.longitude.data
         )
       db.session.add(newVenue)
       db.session.commit()
+      fragment_cache.invalidate(RECENT_VENUES)
+      venue_index.add(newVenue.id, newVenue.name)
       # on successful db insert, flash success
       flashType = 'success'
       flash('Venue {} was successfully listed!'.format(newVenue.name))
@@ -313,7 +958,7 @@ def create_venue_submission():
     flash(form.errors) # Flashes reason, why form is unsuccessful (not really pretty)
     flash('An error occurred due to form validation. Venue {} could not be listed.'.format(request.form['name']))
   
-  return render_template('pages/home.html', flashType = flashType)
+  return render_home(flashType = flashType)
 
 @app.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
@@ -340,6 +985,9 @@ def delete_venue(venue_id):
   try:
     Venue.query.filter_by(id=venue_id).delete()
     db.session.commit()
+    fragment_cache.invalidate(RECENT_VENUES)
+    page_cache.bump('venue', int(venue_id))
+    venue_index.remove(int(venue_id))
   except:
     db.session.rollback()
     # This will alert User that Venue could not be deleted because they are still Shows attached
@@ -354,12 +1002,18 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  '''List all Artists
+  '''List Artists, alphabetically by initial
   
-  * Input: None
+  * Input (query string, all optional):
+    - <string> letter: initial of the listed Artists, defaults to the first initial
+    - <string> cursor: position after the last Artist of the previous page
+    - <string> genre: only Artists with this genre, can be repeated
 
   Contains following features:
-    - See all Artists listed
+    - See how many Artists start with each letter, from one grouped query
+    - See Artists of one letter, page by page. Pages are selected by a keyset cursor
+      on (name, id), so every page costs the same, no matter how many Artists exist
+    - Narrow Artists down by genres, see how many Artists each genre has
     - Clicking on a Artist links to its detail dage under "/artists/<int:artist_id>"
   
   Corresponding HTML:
@@ -367,9 +1021,37 @@ def artists():
 
   '''
   # TODO DONE: replace with real data returned from querying the database
-  # Simply query database for all existing artists
-  artists = Artist.query.all()
-  return render_template('pages/artists.html', artists=artists)
+  # Both queries are served by the index on (upper(left(name, 1)), name, id),
+  # selected genres by the GIN index on genres
+  initial = func.upper(func.left(Artist.name, 1))
+  genres = selected_genres()
+
+  # Step 1: Count Artists per initial letter
+  letters = (db.session.query(
+    initial.label('letter'),
+    func.count().label('count'))
+    .group_by(initial)
+    .order_by(initial))
+  if genres:
+    letters = letters.filter(genre_condition(Artist, genres))
+  letters = letters.all()
+
+  # Step 2: Get one page of Artists of the selected letter, only with the columns the template needs
+  letter = request.args.get('letter') or (letters[0].letter if letters else '')
+  query = (db.session.query(
+    Artist.id,
+    Artist.name)
+    .filter(initial == letter)
+    .order_by(Artist.name, Artist.id))
+  if genres:
+    query = query.filter(genre_condition(Artist, genres))
+  cursor = request.args.get('cursor')
+  if cursor:
+    query = query.filter(tuple_(Artist.name, Artist.id) > tuple_(*decode_cursor(cursor)))
+
+  page = KeysetPage(query, app.config['ARTISTS_PAGE_SIZE'], lambda artist: artist.name)
+  return render_template('pages/artists.html', artists=page, letters=letters, letter=letter,
+    facets=genre_facets(Artist, genres), genres=genres)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -392,17 +1074,11 @@ def search_artists():
   # get search term from request
   search_term=request.form.get('search_term', '').lower()
 
-  # use search term to count, how many occurance can be find in database
-  search_artist_count = db.session.query(func.count(Artist.id)).filter(func.lower(Artist.name).contains(search_term)).all()
-  
-  # use search term to find all Artist records in database
-  search_artist_result = Artist.query.filter(func.lower(Artist.name).contains(search_term)).all()
-  
-  # create a well formatted response with above results
-  response={
-    "count": search_artist_count[0][0],
-    "data": search_artist_result
-  }
+  # get requested page from request, the first page is the default
+  page = max(request.form.get('page', 1, type=int), 1)
+
+  # use search term to get the total number of matches and the requested page of results
+  response = ranked_search(Artist, search_term, page)
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
@@ -421,46 +1097,11 @@ def show_artist(artist_id):
   '''
   # TODO DONE: replace with real artist data from the artists table, using artist_id
   
-  # Step 1: Get single Artist
-  single_artist = Artist.query.get(artist_id)
-
-  # Step 2: Get Past Shows
-  single_artist.past_shows = (db.session.query(
-    Venue.id.label("venue_id"), 
-    Venue.name.label("venue_name"), 
-    Venue.image_link.label("venue_image_link"), 
-    Show)
-    .join(Artist)
-    .join(Venue)
-    .filter(Show.c.start_time <= datetime.now())
-    .all())
-  
-  # Step 3: Get Upcomming Shows
-  single_artist.upcoming_shows = (db.session.query(
-    Venue.id.label("venue_id"), 
-    Venue.name.label("venue_name"), 
-    Venue.image_link.label("venue_image_link"), 
-    Show)
-    .join(Artist)
-    .join(Venue)
-    .filter(Show.c.start_time > datetime.now())
-    .all())
-
-  # Step 4: Get Number of past Shows
-  single_artist.past_shows_count = (db.session.query(
-    func.count(Show.c.Artist_id))
-    .join(Artist)
-    .filter(Show.c.start_time < datetime.now())
-    .all())[0][0]
-  
-  # Step 5: Get Number of Upcoming Shows
-  single_artist.upcoming_shows_count = (db.session.query(
-    func.count(Show.c.Artist_id))
-    .join(Artist)
-    .filter(Show.c.start_time > datetime.now())
-    .all())[0][0]
-
-  return render_template('pages/show_artist.html', artist=single_artist)
+  # Serve the page from the page cache. On a miss, get the Artist with its past & upcoming Shows
+  # and their counts in one single query, and its precomputed similar Artists
+  return render_detail_page('artist', artist_id,
+    lambda: get_artist_page(artist_id),
+    'pages/show_artist.html')
 
 #  Update
 #  ----------------------------------------------------------------
@@ -513,15 +1154,18 @@ def edit_artist_submission(artist_id):
   # TODO DONE: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
   
-  artist = Venue.query.get(artist_id)
-  artist.name = request.form['name'],
-  artist.city = request.form['city'],
-  artist.state = request.form['state'],
-  artist.phone = request.form['phone'],
-  artist.genres = request.form['genres'],
+  artist = Artist.query.get_or_404(artist_id)
+  artist.name = request.form['name']
+  artist.city = request.form['city']
+  artist.state = request.form['state']
+  artist.phone = request.form['phone']
+  artist.genres = request.form.getlist('genres')
   artist.facebook_link = request.form['facebook_link']
   db.session.add(artist)
   db.session.commit()
+  fragment_cache.invalidate(RECENT_ARTISTS)
+  invalidate_artist_pages(artist_id)
+  artist_index.add(int(artist_id), request.form['name'])
   db.session.close()
 
   # Redirect user to artist detail page with updated values
@@ -555,6 +1199,8 @@ def edit_venue(venue_id):
   form.phone.data = venue.phone
   form.genres.data = venue.genres
   form.facebook_link.data = venue.facebook_link
+  form.latitude.data = venue.latitude
+  form.longitude.data = venue.longitude
 
   # TODO DONE: populate form with values from venue with ID <venue_id>
   return render_template('forms/edit_venue.html', form=form, venue=venue)
@@ -576,16 +1222,32 @@ def edit_venue_submission(venue_id):
   # TODO DONE: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
   
-  venue = Venue.query.get(venue_id)
-  venue.name = request.form['name'],
-  venue.city = request.form['city'],
-  venue.state = request.form['state'],
-  venue.address = request.form['address'],
-  venue.phone = request.form['phone'],
-  venue.genres = request.form.getlist('genres'),
+  venue = Venue.query.get_or_404(venue_id)
+
+  # Coordinates get the range checks of the create form, /venues/near relies on them
+  form = VenueForm(request.form)
+  invalid = [field for field in (form.latitude, form.longitude) if not field.validate(form)]
+  if invalid:
+    for field in invalid:
+      flash('{}: {}'.format(field.label.text, ' '.join(field.errors)))
+    flash('An error occurred due to form validation. Venue {} could not be updated.'.format(venue.name))
+    return redirect(url_for('edit_venue', venue_id=venue_id))
+
+  venue.name = request.form['name']
+  venue.city = request.form['city']
+  venue.state = request.form['state']
+  venue.address = request.form['address']
+  venue.phone = request.form['phone']
+  venue.genres = request.form.getlist('genres')
   venue.facebook_link = request.form['facebook_link']
+  # Empty coordinates are stored as NULL
+  venue.latitude = form.latitude.data
+  venue.longitude = form.longitude.data
   db.session.add(venue)
   db.session.commit()
+  fragment_cache.invalidate(RECENT_VENUES)
+  invalidate_venue_pages(venue_id)
+  venue_index.add(int(venue_id), request.form['name'])
   db.session.close()
 
   # Redirect user to venue detail page with updated values
@@ -634,6 +1296,8 @@ def create_artist_submission():
         )
       db.session.add(newArtist)
       db.session.commit()
+      fragment_cache.invalidate(RECENT_ARTISTS)
+      artist_index.add(newArtist.id, newArtist.name)
       # on successful db insert, flash success
       flashType = 'success'
       flash('Artist {} was successfully listed!'.format(newArtist.name)) 
@@ -647,7 +1311,7 @@ def create_artist_submission():
     flash(form.errors) # Flashes reason, why form is unsuccessful (not really pretty)
     flash('An error occurred due to form validation. Artist {} could not be listed.'.format(request.form['name']))
 
-  return render_template('pages/home.html', flashType = flashType)
+  return render_home(flashType = flashType)
 
 
 #  Shows
@@ -656,31 +1320,57 @@ def create_artist_submission():
 @app.route('/shows')
 def shows():
   '''
-  List all Shows
-  * Input: None
+  List Shows, page by page
+  * Input (query string, all optional):
+    - <date> start: only Shows starting on or after this day (YYYY-MM-DD)
+    - <date> end: only Shows starting on or before this day (YYYY-MM-DD)
+    - <string> cursor: position after the last Show of the previous page
   Contains following features:
-    - See all Shows
+    - See Shows in chronological order, within a date window
     - See corresponding artist information for each Show
+    - Pages are selected by a keyset cursor on (start_time, id), so every page
+      costs the same, no matter how many Shows are before it
+    - The page is streamed, memory and time to first byte are bounded by the page size
   Corresponding HTML:
     - templates/pages/shows.html
   '''
   # TODO DONE: replace with real shows data.
   # TODO DONE: num_shows should be aggregated based on number of upcoming shows per venue.
-  
-  # Make a database query to get all shows
+  start = parse_date_arg('start')
+  end = parse_date_arg('end')
+  cursor = request.args.get('cursor')
+
+  # Windows that start before the archive horizon read archived Shows as well
+  shows = show_source(start)
+
+  # Make a database query to get the shows, sorted by the keyset (start_time, id)
   # Rename Fields so frontend can access the correct values
-  shows = (db.session.query(
+  query = (db.session.query(
     Venue.id.label("venue_id"), 
     Venue.name.label("venue_name"),
     Artist.id.label("artist_id"), 
     Artist.name.label("artist_name"), 
     Artist.image_link.label("artist_image_link"), 
-    Show)
-    .join(Artist)
-    .join(Venue)
-    .all())
-
-  return render_template('pages/shows.html', shows=shows)
+    shows.id,
+    shows.start_time)
+    .select_from(shows)
+    .join(Artist, Artist.id == shows.Artist_id)
+    .join(Venue, Venue.id == shows.Venue_id)
+    .order_by(shows.start_time, shows.id))
+
+  # Date window and cursor are range conditions on the index (start_time, id) of each table
+  if start:
+    query = query.filter(shows.start_time >= start)
+  if end:
+    query = query.filter(shows.start_time < end + timedelta(days=1))
+  if cursor:
+    query = query.filter(tuple_(shows.start_time, shows.id) > tuple_(*decode_cursor(cursor, dateutil.parser.parse)))
+
+  page = KeysetPage(query, app.config['SHOWS_PAGE_SIZE'], lambda show: show.start_time.isoformat())
+  return Response(stream_with_context(stream_template('pages/shows.html',
+    shows=page,
+    start=request.args.get('start'),
+    end=request.args.get('end'))))
 
 @app.route('/shows/create')
 def create_shows():
@@ -712,22 +1402,32 @@ def create_show_submission():
 
   form = ShowForm(request.form) # Initialize form instance with values from the request
   flashType = 'danger' # Initialize flashType to danger. Either it will be changed to "success" on successfully db insert, or in all other cases it should be equal to "danger"
+  conflict = None # Message of a double booking, it is shown on the form
   if form.validate():
     # NOTE: Form could not be validated due to a missing csrf-token.
     # I solved this issue by putting a "{{ form.csrf_token() }}"
     # under the respective <form> tag in forms/new_show.html
     try:
       # Create a new instance of Show with data from ShowForm
-      newShow = Show.insert().values(
+      newShow = Show(
         Venue_id = request.form['venue_id'],
         Artist_id = request.form['artist_id'],
-        start_time = request.form['start_time']
+        start_time = form.start_time.data,
+        end_time = form.end_time.data or default_end_time(form.start_time.data),
+        capacity = form.capacity.data
       )
-      db.session.execute(newShow) 
+      db.session.add(newShow)
       db.session.commit()
+      page_cache.bump('venue', newShow.Venue_id)
+      page_cache.bump('artist', newShow.Artist_id)
       # on successful db insert, flash success
       flashType = 'success'
       flash('Show was successfully listed!')
+    except IntegrityError as error:
+      db.session.rollback()
+      conflict = booking_conflict(error)
+      if conflict is None:
+        flash('An error occurred due to database insertion error. Show could not be listed.')
     except : 
       # TODO DONE: on unsuccessful db insert, flash an error instead.
       flash('An error occurred due to database insertion error. Show could not be listed.')
@@ -737,8 +1437,178 @@ def create_show_submission():
   else:
     flash(form.errors) # Flashes reason, why form is unsuccessful (not really pretty)
     flash('An error occurred due to form validation. Show could not be listed.')
-  
-  return render_template('pages/home.html', flashType = flashType)
+
+  if conflict:
+    # Let the user pick another time on the same form
+    form.start_time.errors.append(conflict)
+    return render_template('forms/new_show.html', form=form), 409
+  return render_home(flashType = flashType)
+
+#  Typeahead
+#  ----------------------------------------------------------------
+
+@app.route('/typeahead/<any(venues, artists):kind>')
+def typeahead(kind):
+  '''Suggest Venues or Artists by the beginning of their name
+
+  * Input:
+    - <string> kind: "venues" or "artists"
+    - query string: <string> q, the typed text; <int> limit, optional, defaults to TYPEAHEAD_LIMIT
+  * Output: JSON with up to limit "results" (id & name) whose name or one of its words starts with q
+
+  Served from the in-memory prefix index of typeahead.py, no query per keystroke.
+
+  Used in following HTML:
+    - templates/forms/new_show.html
+  '''
+  limit = request.args.get('limit', app.config['TYPEAHEAD_LIMIT'], type=int)
+  limit = max(1, min(limit, app.config['TYPEAHEAD_MAX_LIMIT']))
+  index = venue_index if kind == 'venues' else artist_index
+  return jsonify({'results': index.search(request.args.get('q', ''), limit)})
+
+#  Tickets
+#  ----------------------------------------------------------------
+
+@app.route('/shows/<int:show_id>/holds', methods=['POST'])
+def create_ticket_hold(show_id):
+  '''Hold tickets of a Show
+
+  * Input:
+    - <int> show_id
+    - <int> quantity: form field or JSON key, defaults to 1, at most TICKET_MAX_PER_HOLD
+  * Output: JSON with the "token" of the hold and when it expires (201),
+    409 if not enough tickets are left, 404 if the Show is not on sale
+
+  The tickets stay reserved until the hold is confirmed, released or expires.
+  '''
+  data = request.get_json(silent=True) or request.form
+  try:
+    quantity = int(data.get('quantity', 1))
+  except (TypeError, ValueError):
+    abort(400)
+  if not 1 <= quantity <= app.config['TICKET_MAX_PER_HOLD']:
+    abort(400)
+
+  hold = tickets.reserve(show_id, quantity)
+  db.session.commit()
+  if hold is None:
+    # Only a failed reservation needs to know why it failed
+    capacity = db.session.query(Show.capacity).filter(Show.id == show_id).scalar()
+    if capacity is None:
+      abort(404)
+    return jsonify({'error': 'Not enough tickets left.'}), 409
+  hold['expires_at'] = hold['expires_at'].isoformat()
+  return jsonify(hold), 201
+
+@app.route('/holds/<token>/confirm', methods=['POST'])
+def confirm_ticket_hold(token):
+  '''Buy the tickets of a hold
+
+  * Input: <string> token of the hold
+  * Output: JSON with "show_id" and "quantity" of the sold tickets, 404 if the hold does not exist or expired
+  '''
+  sold = tickets.confirm(token)
+  db.session.commit()
+  if sold is None:
+    abort(404)
+  return jsonify(sold)
+
+@app.route('/holds/<token>', methods=['DELETE'])
+def release_ticket_hold(token):
+  '''Release the tickets of a hold
+
+  * Input: <string> token of the hold
+  * Output: 204, 404 if the hold does not exist (any more)
+  '''
+  released = tickets.release(token)
+  db.session.commit()
+  if not released:
+    abort(404)
+  return '', 204
+
+#  Stats
+#  ----------------------------------------------------------------
+
+@app.route('/stats')
+def stats():
+  '''Number of Shows per month, by genre, city or state
+
+  * Input (query string, all optional):
+    - <string> by: "genre" (default), "city" or "state"
+    - <month> start, end: first and last month (YYYY-MM), by default from STATS_MONTHS_BACK
+      months ago to STATS_MONTHS_AHEAD months ahead, at most STATS_MAX_MONTHS months
+    - <string> state: only Shows at Venues of this state
+    - <string> genre: only Shows of Artists of this genre
+
+  Contains following features:
+    - Reads the Show rollup maintained by stats.py only, never Show, Venue or Artist
+
+  Corresponding HTML:
+    - templates/pages/stats.html
+  '''
+  by = request.args.get('by') or 'genre'
+  if by not in ('genre', 'city', 'state'):
+    abort(400)
+  this_month = datetime.now().date().replace(day=1)
+  first = parse_month_arg('start') or add_months(this_month, -app.config['STATS_MONTHS_BACK'])
+  last = parse_month_arg('end') or add_months(this_month, app.config['STATS_MONTHS_AHEAD'])
+  if first > last or add_months(first, app.config['STATS_MAX_MONTHS']) <= last:
+    abort(400)
+  state = request.args.get('state') or None
+  genre = request.args.get('genre') or None
+
+  return render_template('pages/stats.html',
+    stats=get_stats(by, first, last, state=state, genre=genre),
+    by=by,
+    start=first.strftime('%Y-%m'),
+    end=last.strftime('%Y-%m'),
+    state=state,
+    genre=genre,
+    states=[value for value, label in ArtistForm.state.kwargs['choices']],
+    genres=[value for value, label in ArtistForm.genres.kwargs['choices']])
+
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<any(venues, artists, shows):kind>.<any(csv, ndjson):file_format>')
+def export(kind, file_format):
+  '''Export Venues, Artists or Shows as CSV or NDJSON
+
+  * Input:
+    - <string> kind: "venues", "artists" or "shows"
+    - <string> file_format: "csv" or "ndjson"
+    - query string, all optional:
+      - <string> city: only Venues/Artists of this city, only Shows at Venues of this city
+      - <date> start, end: only Shows starting within these days (YYYY-MM-DD), both inclusive
+
+  Contains following features:
+    - Rows are read from a server side cursor and streamed as chunked response,
+      memory stays flat no matter how many rows are exported
+    - Filters are applied in the SQL query
+    - CSV files can be imported again with "flask import-catalog"
+  '''
+  start = parse_date_arg('start')
+  end = parse_date_arg('end')
+  rows = export_query(kind,
+    start=start,
+    end=end + timedelta(days=1) if end else None,
+    city=request.args.get('city'))
+
+  chunks = csv_chunks(kind, rows) if file_format == 'csv' else ndjson_chunks(kind, rows)
+  return Response(stream_with_context(chunks),
+    mimetype='text/csv' if file_format == 'csv' else 'application/x-ndjson',
+    headers={'Content-Disposition': 'attachment; filename={}.{}'.format(kind, file_format)})
+
+#  Cache
+#  ----------------------------------------------------------------
+
+@app.route('/cache/stats')
+def cache_stats():
+  '''Returns hit & miss counters of the fragment and page cache of this worker as JSON'''
+  return jsonify({
+    'fragments': fragment_cache.stats(),
+    'pages': page_cache.stats()
+  })
 
 @app.errorhandler(404)
 def not_found_error(error):
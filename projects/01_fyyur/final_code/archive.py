@@ -0,0 +1,102 @@
+"""
+Contains the archive of past Shows.
+
+Most Shows are long over and never change again. The archive job moves Shows
+that ended more than ARCHIVE_AFTER_DAYS ago from Show to ShowArchive, e.g.
+every night with cron:
+
+  FLASK_APP=app.py flask archive-shows
+
+Queries of upcoming and recent Shows read the small Show table only. The
+history of a Venue or Artist, /shows and the export read both tables through
+show_history(). Only Shows that the counters already count as past Shows are
+archived (see counters.py), archived Shows stay counted as past Shows.
+"""
+
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import aliased
+
+from models import Show, ShowArchive, ShowCounterState, app, db
+
+# Columns that Show and ShowArchive have in common
+ARCHIVED_COLUMNS = ('id', 'Venue_id', 'Artist_id', 'start_time', 'end_time', 'capacity', 'tickets_sold')
+
+
+def show_history():
+    '''Returns Show and ShowArchive as one entity (UNION ALL) with the columns of ARCHIVED_COLUMNS
+
+    * Output: <AliasedClass> of Show, used like Show in queries
+
+    Postgres pushes conditions on the columns down into both tables, so their indexes are used.
+    '''
+    history = union_all(
+        select([Show.__table__.c[name] for name in ARCHIVED_COLUMNS]),
+        select([ShowArchive.__table__.c[name] for name in ARCHIVED_COLUMNS])).alias('show_history')
+    return aliased(Show, history, adapt_on_names=True)
+
+def archive_horizon(now=None):
+    '''Returns the point in time from which on Shows are never archived'''
+    return (now or datetime.now()) - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+
+def show_source(since=None):
+    '''Returns the entity to query Shows starting on or after since from
+
+    * Input: <datetime> since, None for all Shows
+    * Output: Show, if none of these Shows can be archived, otherwise show_history()
+    '''
+    if since is not None and since >= archive_horizon():
+        return Show
+    return show_history()
+
+def archive_cutoff(now=None):
+    '''Returns the end time before which Shows are archived, None if nothing may be archived
+
+    Shows that the counters still count as upcoming Shows (not rolled over yet) are kept.
+    '''
+    rolled_over_at = db.session.query(ShowCounterState.rolled_over_at).scalar()
+    if rolled_over_at is None:
+        return None
+    return min(archive_horizon(now), rolled_over_at)
+
+def archive_batch(cutoff, batch_size):
+    '''Moves up to batch_size Shows that ended before cutoff into ShowArchive
+
+    * Output: <int> number of moved Shows. The caller commits.
+
+    One statement deletes the Shows and inserts the returned rows into the archive.
+    The oldest Shows are moved first, through the index on (start_time, id). Shows
+    locked by other transactions are skipped. Ticket holds of moved Shows are deleted.
+    '''
+    show = Show.__table__
+    batch = (select([show.c.id])
+        .where(show.c.start_time < cutoff)
+        .where(show.c.end_time < cutoff)
+        .order_by(show.c.start_time)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True))
+    moved = (show.delete()
+        .where(show.c.id.in_(batch))
+        .returning(*[show.c[name] for name in ARCHIVED_COLUMNS])
+        .cte('moved'))
+    return db.session.execute(ShowArchive.__table__.insert().from_select(
+        ARCHIVED_COLUMNS, select([moved.c[name] for name in ARCHIVED_COLUMNS]))).rowcount
+
+@app.cli.command('archive-shows')
+@click.option('--batch-size', default=5000, show_default=True, help='Number of Shows per transaction.')
+def archive_shows_command(batch_size):
+    '''Moves Shows that ended ARCHIVE_AFTER_DAYS ago into the archive.'''
+    cutoff = archive_cutoff()
+    if cutoff is None:
+        click.echo('Nothing archived, run "flask rollover-show-counters" first.')
+        return
+    archived = 0
+    while True:
+        moved = archive_batch(cutoff, batch_size)
+        db.session.commit()
+        archived += moved
+        if moved < batch_size:
+            break
+    click.echo('Archived {} Shows that ended before {}.'.format(archived, cutoff))
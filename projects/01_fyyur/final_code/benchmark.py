@@ -0,0 +1,539 @@
+"""
+Contains benchmarks for the views of the application.
+
+Views are requested through the Flask test client; latency and the number of
+SQL statements sent to the database are reported. There are two modes:
+
+  - Scenarios seed their own rows into the configured database, measure one
+    view at growing scales and remove the rows (prefixed with BENCH_PREFIX) again:
+
+      python benchmark.py scenario venues --scales 10 100 1000
+
+  - The route suite requests every route on an existing dataset (see seed.py),
+    records p50/p95/p99 latency and query counts to JSON and compares a run
+    against a stored baseline:
+
+      python benchmark.py run --output results.json
+      python benchmark.py compare results.json baseline.json
+
+  - The startup benchmark measures import time and the first requests of a
+    fresh process, without and with the template bytecode cache and warm-up:
+
+      python benchmark.py startup
+
+  - The datetime benchmark renders 10k Shows with the "datetime" filter, with
+    plain babel calls and with the caches of date_format.py:
+
+      python benchmark.py datetime --count 10000
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import babel.dates
+from jinja2 import Environment
+from sqlalchemy import event, func
+
+import app as views # Importing the module registers all views on the app
+import counters
+import date_format
+import stats
+from cache import page_cache
+from models import Venue, Show, Artist, app, db
+from seed import GENRES, CITY_CENTERS
+
+BENCH_PREFIX = 'bench-'
+# Seeded Shows start at whole minutes and last one second, so they never violate the booking constraints
+BENCH_SHOW_LENGTH = timedelta(seconds=1)
+# Concurrent buyers of the ticket_rush scenario, within the default connection pool (5 + 10 overflow)
+BENCH_BUYERS = 10
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+@contextmanager
+def count_queries():
+    '''Counts the SQL statements executed inside of the with block
+
+    * Output: <list> with a single element, the number of statements so far
+    '''
+    counter = [0]
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter[0] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+def percentile(timings, fraction):
+    '''Returns the nearest-rank percentile of an ascending list'''
+    return timings[max(0, math.ceil(fraction * len(timings)) - 1)]
+
+def measure(client, method, url, repeat, data=None, before_each=None):
+    '''Requests url repeatedly and returns latency percentiles and the query count
+
+    * Input:
+        - <FlaskClient> client
+        - <string> method, url
+        - <int> repeat
+        - <dict> data: optional form data
+        - <function> before_each: optional, called before every request, not timed
+    * Output: <dict> with "p50", "p95", "p99" in milliseconds and "queries" per request
+    '''
+    timings = []
+    with count_queries() as counter:
+        for _ in range(repeat):
+            if before_each:
+                before_each()
+            started = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            response.get_data() # Streamed responses are only rendered while they are read
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, '{} {} returned {}'.format(method, url, response.status_code)
+    timings.sort()
+    return {
+        'p50': round(percentile(timings, 0.50), 2),
+        'p95': round(percentile(timings, 0.95), 2),
+        'p99': round(percentile(timings, 0.99), 2),
+        'queries': round(counter[0] / repeat, 2)
+    }
+
+def timed_get(client, url, repeat, before_each=None):
+    '''Requests url repeatedly and returns the median latency and query count
+
+    * Output: <dict> with "ms" and "queries"
+    '''
+    result = measure(client, 'GET', url, repeat, before_each=before_each)
+    return {
+        'ms': result['p50'],
+        'queries': result['queries']
+    }
+
+def seed(venues=0, artists=0, shows=0):
+    '''Inserts benchmark rows with executemany and returns the new ids
+
+    Venues are spread over ten areas, Shows are spread round-robin over the
+    seeded Venues and Artists, half of them in the past, half in the future.
+    '''
+    now = datetime.now()
+    if venues:
+        db.session.execute(Venue.__table__.insert(), [{
+            'name': '{}venue-{}'.format(BENCH_PREFIX, i),
+            'city': '{}city-{}'.format(BENCH_PREFIX, i % 10),
+            'state': 'NY',
+            'seeking_talent': False
+        } for i in range(venues)])
+    if artists:
+        db.session.execute(Artist.__table__.insert(), [{
+            'name': '{}artist-{}'.format(BENCH_PREFIX, i),
+            'city': '{}city-{}'.format(BENCH_PREFIX, i % 10),
+            'state': 'NY',
+            'seeking_venue': False
+        } for i in range(artists)])
+    venue_ids = [v.id for v in db.session.query(Venue.id).filter(Venue.name.startswith(BENCH_PREFIX))]
+    artist_ids = [a.id for a in db.session.query(Artist.id).filter(Artist.name.startswith(BENCH_PREFIX))]
+    if shows:
+        starts = [now + timedelta(days=(i % 365) - 182, minutes=i) for i in range(shows)]
+        db.session.execute(Show.__table__.insert(), [{
+            'Venue_id': venue_ids[i % len(venue_ids)],
+            'Artist_id': artist_ids[i % len(artist_ids)],
+            'start_time': start_time,
+            'end_time': start_time + BENCH_SHOW_LENGTH
+        } for i, start_time in enumerate(starts)])
+    db.session.commit()
+    return venue_ids, artist_ids
+
+def cleanup():
+    '''Removes every row that has been created by seed() and recounts the Shows'''
+    venue_ids = db.session.query(Venue.id).filter(Venue.name.startswith(BENCH_PREFIX))
+    artist_ids = db.session.query(Artist.id).filter(Artist.name.startswith(BENCH_PREFIX))
+    Show.query.filter(Show.Venue_id.in_(venue_ids.subquery())).delete(synchronize_session=False)
+    Show.query.filter(Show.Artist_id.in_(artist_ids.subquery())).delete(synchronize_session=False)
+    Venue.query.filter(Venue.name.startswith(BENCH_PREFIX)).delete(synchronize_session=False)
+    Artist.query.filter(Artist.name.startswith(BENCH_PREFIX)).delete(synchronize_session=False)
+    db.session.commit()
+    # The bulk deletes bypass the listeners that keep the Show counters and the rollup
+    # up to date, while Shows added through the ORM (ticket_rush) have been counted
+    counters.rebuild()
+    stats.rebuild()
+
+#----------------------------------------------------------------------------#
+# Scenarios.
+#----------------------------------------------------------------------------#
+
+SCENARIOS = {}
+
+def scenario(func):
+    '''Registers a benchmark under the name of the function'''
+    SCENARIOS[func.__name__] = func
+    return func
+
+@scenario
+def home(client, scale, repeat):
+    '''/ with <scale> Artists and Venues, cached fragments must need no queries'''
+    seed(venues=scale, artists=scale)
+    return timed_get(client, '/', repeat)
+
+@scenario
+def venues(client, scale, repeat):
+    '''/venues with <scale> Venues and two Shows per Venue
+
+    The number of queries must not change with the scale.
+    '''
+    seed(venues=scale, artists=10, shows=scale * 2)
+    return timed_get(client, '/venues', repeat)
+
+def detail_page(client, kind, scale, repeat, cached=False):
+    '''Requests the detail page of a Venue or Artist with 10 own Shows
+    while <scale> Shows of other Venues and Artists exist.
+
+    Unless cached is set, the page cache is bypassed to measure the query.
+    '''
+    venue_ids, artist_ids = seed(venues=10, artists=10, shows=scale)
+    venue = Venue(name=BENCH_PREFIX + 'target', city=BENCH_PREFIX + 'city', state='NY')
+    artist = Artist(name=BENCH_PREFIX + 'target', city=BENCH_PREFIX + 'city', state='NY')
+    db.session.add_all([venue, artist])
+    db.session.flush()
+    # Half a minute off the seeded Shows, which may share the Venue or Artist
+    now = datetime.now() + timedelta(seconds=30)
+    db.session.execute(Show.__table__.insert(), [{
+        'Venue_id': venue.id if kind == 'venues' else venue_ids[0],
+        'Artist_id': artist.id if kind == 'artists' else artist_ids[0],
+        'start_time': now + timedelta(days=days),
+        'end_time': now + timedelta(days=days) + BENCH_SHOW_LENGTH
+    } for days in range(-5, 5)])
+    db.session.commit()
+    target_id = venue.id if kind == 'venues' else artist.id
+    bypass_cache = None if cached else lambda: page_cache.bump(kind[:-1], target_id)
+    return timed_get(client, '/{}/{}'.format(kind, target_id), repeat, before_each=bypass_cache)
+
+@scenario
+def show_venue(client, scale, repeat):
+    '''/venues/<id> with <scale> unrelated Shows, latency must stay flat'''
+    return detail_page(client, 'venues', scale, repeat)
+
+@scenario
+def show_artist(client, scale, repeat):
+    '''/artists/<id> with <scale> unrelated Shows, latency must stay flat'''
+    return detail_page(client, 'artists', scale, repeat)
+
+@scenario
+def show_artist_cached(client, scale, repeat):
+    '''/artists/<id> served from the page cache, must need no queries'''
+    return detail_page(client, 'artists', scale, repeat, cached=True)
+
+@scenario
+def artists(client, scale, repeat):
+    '''/artists with <scale> Artists, a page must cost the same for every scale'''
+    seed(artists=scale)
+    return timed_get(client, '/artists', repeat)
+
+@scenario
+def shows(client, scale, repeat):
+    '''/shows with <scale> Shows, a page must cost the same for every scale'''
+    seed(venues=10, artists=10, shows=scale)
+    return timed_get(client, '/shows', repeat)
+
+@scenario
+def ticket_rush(client, scale, repeat):
+    '''<scale> tickets of one Show, bought one by one by BENCH_BUYERS concurrent buyers
+
+    Every buyer holds and confirms a ticket until the Show is sold out. No ticket may be
+    oversold and none may be left. Reports holds per second under contention; repeat is not used.
+    '''
+    venue_ids, artist_ids = seed(venues=1, artists=1)
+    start_time = datetime.now() + timedelta(days=30)
+    show = Show(Venue_id=venue_ids[0], Artist_id=artist_ids[0], start_time=start_time,
+                end_time=start_time + BENCH_SHOW_LENGTH, capacity=scale)
+    db.session.add(show)
+    db.session.commit()
+    show_id = show.id
+
+    confirmed = []
+    holds = []
+    def buyer():
+        buyer_client = app.test_client()
+        bought = held = 0
+        while True:
+            response = buyer_client.post('/shows/{}/holds'.format(show_id), data={'quantity': 1})
+            if response.status_code == 409:
+                break
+            assert response.status_code == 201, 'hold returned {}'.format(response.status_code)
+            held += 1
+            response = buyer_client.post('/holds/{}/confirm'.format(response.get_json()['token']))
+            assert response.status_code == 200, 'confirm returned {}'.format(response.status_code)
+            bought += 1
+        holds.append(held)
+        confirmed.append(bought)
+
+    buyers = [threading.Thread(target=buyer) for _ in range(BENCH_BUYERS)]
+    started = time.perf_counter()
+    for thread in buyers:
+        thread.start()
+    for thread in buyers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    inventory = db.session.query(Show.tickets_sold, Show.tickets_held).filter(Show.id == show_id).one()
+    assert len(confirmed) == BENCH_BUYERS, 'a buyer failed'
+    assert sum(confirmed) == inventory.tickets_sold == scale, 'sold {} of {} tickets'.format(sum(confirmed), scale)
+    assert inventory.tickets_held == 0
+    return {
+        'ms': round(elapsed * 1000, 2),
+        'holds_per_sec': round(sum(holds) / elapsed, 1),
+        'buyers': BENCH_BUYERS,
+        'sold': inventory.tickets_sold
+    }
+
+#----------------------------------------------------------------------------#
+# Route Suite.
+#----------------------------------------------------------------------------#
+
+def sample(model, rng):
+    '''Returns a random row (id, name) of a model, chosen by the seeded generator'''
+    count = db.session.query(func.count(model.id)).scalar()
+    if not count:
+        sys.exit('The database is empty, generate a dataset first: flask seed-catalog')
+    return db.session.query(model.id, model.name).order_by(model.id).offset(rng.randrange(count)).first()
+
+def suite_routes(rng):
+    '''Returns (name, method, url, data, before_each) of every route of the suite
+
+    Ids and search terms are sampled from the dataset. Detail pages are measured
+    with and without the page cache.
+    '''
+    venue = sample(Venue, rng)
+    artist = sample(Artist, rng)
+    today = date.today()
+    window = 'start={}&end={}'.format(today.isoformat(), (today + timedelta(days=30)).isoformat())
+    return [
+        ('GET /', 'GET', '/', None, None),
+        ('GET /venues', 'GET', '/venues', None, None),
+        ('GET /venues?genre', 'GET', '/venues?genre={}'.format(rng.choice(GENRES)), None, None),
+        ('GET /venues/<id>', 'GET', '/venues/{}'.format(venue.id), None, lambda: page_cache.bump('venue', venue.id)),
+        ('GET /venues/<id> cached', 'GET', '/venues/{}'.format(venue.id), None, None),
+        ('GET /venues/near', 'GET', '/venues/near?lat={}&lng={}&radius_km=25'.format(*rng.choice(list(CITY_CENTERS.values()))), None, None),
+        ('POST /venues/search', 'POST', '/venues/search', {'search_term': venue.name.split()[0]}, None),
+        ('GET /artists', 'GET', '/artists', None, None),
+        ('GET /artists?genre', 'GET', '/artists?genre={}'.format(rng.choice(GENRES)), None, None),
+        ('GET /artists/<id>', 'GET', '/artists/{}'.format(artist.id), None, lambda: page_cache.bump('artist', artist.id)),
+        ('GET /artists/<id> cached', 'GET', '/artists/{}'.format(artist.id), None, None),
+        ('GET /typeahead/artists', 'GET', '/typeahead/artists?q={}'.format(artist.name[:3]), None, None),
+        ('POST /artists/search', 'POST', '/artists/search', {'search_term': artist.name.split()[0]}, None),
+        ('GET /search', 'GET', '/search?q={}'.format(artist.name.split()[0]), None, None),
+        ('GET /shows', 'GET', '/shows', None, None),
+        ('GET /shows?start&end', 'GET', '/shows?' + window, None, None),
+        ('GET /api/v1/shows?fields', 'GET', '/api/v1/shows?fields=id,start_time,venue_name&' + window, None, None),
+        ('GET /stats', 'GET', '/stats', None, None),
+        ('GET /stats?by=city', 'GET', '/stats?by=city&genre={}'.format(rng.choice(GENRES)), None, None),
+    ]
+
+def run_suite(repeat, seed):
+    '''Measures every route of the suite, returns the results as dict'''
+    rng = random.Random(seed)
+    client = app.test_client()
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(),
+            'repeat': repeat,
+            'seed': seed,
+            'venues': db.session.query(func.count(Venue.id)).scalar(),
+            'artists': db.session.query(func.count(Artist.id)).scalar(),
+            'shows': db.session.query(func.count(Show.id)).scalar()
+        },
+        'routes': {}
+    }
+    for name, method, url, data, before_each in suite_routes(rng):
+        # One untimed request warms up caches and connections
+        client.open(url, method=method, data=data).get_data()
+        results['routes'][name] = measure(client, method, url, repeat, data=data, before_each=before_each)
+        print('{:<28} {}'.format(name, json.dumps(results['routes'][name])))
+    return results
+
+def compare(results, baseline, tolerance):
+    '''Compares a run with a baseline, returns the list of regressions
+
+    A route regresses, if its p95 latency is more than tolerance (e.g. 0.2 = 20%)
+    above the baseline or if it sends more queries than in the baseline.
+    '''
+    regressions = []
+    for name, result in sorted(results['routes'].items()):
+        before = baseline['routes'].get(name)
+        if before is None:
+            print('{:<28} new route'.format(name))
+            continue
+        change = (result['p95'] - before['p95']) / before['p95'] if before['p95'] else 0
+        flags = []
+        if change > tolerance:
+            flags.append('p95 {:+.0%}'.format(change))
+        if result['queries'] > before['queries']:
+            flags.append('queries {} -> {}'.format(before['queries'], result['queries']))
+        print('{:<28} p95 {:>9.2f} ms -> {:>9.2f} ms  {}'.format(
+            name, before['p95'], result['p95'], 'REGRESSION: ' + ', '.join(flags) if flags else 'ok'))
+        if flags:
+            regressions.append(name)
+    return regressions
+
+#----------------------------------------------------------------------------#
+# Startup.
+#----------------------------------------------------------------------------#
+
+# Pages that render a template without querying the database
+STARTUP_URLS = ['/venues/create', '/artists/create', '/shows/create']
+
+# Runs in a fresh process, prints import time and first & second latency of every URL as JSON
+STARTUP_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import app as views
+result = {'import_ms': (time.perf_counter() - started) * 1000, 'first_ms': 0, 'second_ms': 0}
+client = views.app.test_client()
+for attempt in ('first_ms', 'second_ms'):
+    for url in sys.argv[1:]:
+        started = time.perf_counter()
+        client.get(url).get_data()
+        result[attempt] += (time.perf_counter() - started) * 1000
+print(json.dumps(result))
+'''
+
+def probe_startup(cache_dir, warm_up):
+    '''Starts a fresh process with the given template settings, returns its timings'''
+    env = dict(os.environ, TEMPLATE_BYTECODE_CACHE_DIR=cache_dir, TEMPLATE_WARM_UP='1' if warm_up else '0')
+    output = subprocess.run([sys.executable, '-c', STARTUP_PROBE] + STARTUP_URLS, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_startup(repeat):
+    '''Measures startup without cache, with a filled bytecode cache and with warm-up, returns a list of results
+
+    Times are medians over repeat processes. "first_ms" and "second_ms" are the summed
+    latencies of STARTUP_URLS on their first and second request within a process.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        probe_startup(cache_dir, warm_up=True) # fills the bytecode cache
+        for mode, directory, warm_up in (('no cache', '', False), ('bytecode cache', cache_dir, False),
+                                         ('bytecode cache + warm-up', cache_dir, True)):
+            runs = [probe_startup(directory, warm_up) for _ in range(repeat)]
+            result = {'mode': mode}
+            for key in ('import_ms', 'first_ms', 'second_ms'):
+                result[key] = round(statistics.median(run[key] for run in runs), 2)
+            results.append(result)
+    return results
+
+#----------------------------------------------------------------------------#
+# Date Formatting.
+#----------------------------------------------------------------------------#
+
+# The Show list of /shows and of the detail pages
+SHOWS_TEMPLATE = "{% for show in shows %}<h4>{{ show.start_time|datetime('full') }}</h4>{% endfor %}"
+
+DATETIME_FORMATTERS = {
+    'babel': lambda value, format='medium':
+        babel.dates.format_datetime(value, date_format.FORMATS.get(format, format), locale='en'),
+    'cached pattern & locale': lambda value, format='medium': date_format.format_uncached(value, format, 'en'),
+    'cached pattern & locale + memo': lambda value, format='medium': date_format.format_datetime(value, format, 'en')
+}
+
+def run_datetime(count, repeat):
+    '''Renders count Shows with every formatter of DATETIME_FORMATTERS, returns a list of results
+
+    Like in the seeded dataset, 30 Shows share each start time. The memo is emptied
+    before every render, so only repetitions within one page are served from it.
+    '''
+    first = datetime(2026, 1, 1, 20)
+    shows = [{'start_time': first + timedelta(hours=4 * (i // 30))} for i in range(count)]
+    results = []
+    for name, formatter in DATETIME_FORMATTERS.items():
+        environment = Environment()
+        environment.filters['datetime'] = formatter
+        template = environment.from_string(SHOWS_TEMPLATE)
+        timings = []
+        for _ in range(repeat):
+            date_format.format_memoized.cache_clear()
+            started = time.perf_counter()
+            template.render(shows=shows)
+            timings.append((time.perf_counter() - started) * 1000)
+        results.append({'formatter': name, 'shows': count, 'ms': round(statistics.median(timings), 2)})
+    return results
+
+#----------------------------------------------------------------------------#
+# Launch.
+#----------------------------------------------------------------------------#
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the views of Fyyur.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    scenario_parser = commands.add_parser('scenario', help='Seed rows and measure one view at growing scales.')
+    scenario_parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    scenario_parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000])
+    scenario_parser.add_argument('--repeat', type=int, default=5)
+
+    run_parser = commands.add_parser('run', help='Measure every route on the existing dataset.')
+    run_parser.add_argument('--repeat', type=int, default=50)
+    run_parser.add_argument('--seed', type=int, default=42, help='Seed for sampling ids and search terms.')
+    run_parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    compare_parser = commands.add_parser('compare', help='Compare a run with a baseline run.')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 increase, 0.2 = 20%%.')
+    startup_parser = commands.add_parser('startup', help='Measure startup and first requests of fresh processes.')
+    startup_parser.add_argument('--repeat', type=int, default=5)
+    datetime_parser = commands.add_parser('datetime', help='Render Shows with the datetime filter, with and without caches.')
+    datetime_parser.add_argument('--count', type=int, default=10000)
+    datetime_parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == 'datetime':
+        for result in run_datetime(args.count, args.repeat):
+            print(json.dumps(result))
+        return
+
+    if args.command == 'startup':
+        for result in run_startup(args.repeat):
+            print(json.dumps(result))
+        return
+
+    if args.command == 'compare':
+        with open(args.results) as results, open(args.baseline) as baseline:
+            regressions = compare(json.load(results), json.load(baseline), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+    with app.app_context():
+        if args.command == 'run':
+            results = run_suite(args.repeat, args.seed)
+            if args.output:
+                with open(args.output, 'w') as output:
+                    json.dump(results, output, indent=2)
+            return
+
+        client = app.test_client()
+        for scale in args.scales:
+            try:
+                result = SCENARIOS[args.scenario](client, scale, args.repeat)
+            finally:
+                cleanup()
+            result.update(scenario=args.scenario, scale=scale)
+            print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Contains the bulk import of Venues, Artists and Shows from CSV or NDJSON files.
+
+  FLASK_APP=app.py flask import-catalog venues venues.csv
+  FLASK_APP=app.py flask import-catalog shows shows.ndjson --rejects rejects.ndjson
+
+Files are read record by record and inserted in batches with executemany, so
+memory stays constant no matter how big the file is. Invalid records are
+written to the rejects file (NDJSON, stderr by default) and do not abort the run.
+
+Columns / keys of the records:
+  - venues: name (required), city, state, address, phone, image_link,
+    facebook_link, genres, seeking_talent, seeking_description, latitude, longitude
+  - artists: name (required), city, state, phone, image_link, facebook_link,
+    genres, seeking_venue, seeking_description
+  - shows: venue_name, venue_city, venue_state, artist_name, artist_city,
+    artist_state, start_time (required), end_time (defaults to
+    SHOW_DEFAULT_DURATION_HOURS after start_time), capacity (empty: not on
+    sale). Venue and Artist are looked
+    up by their natural key (name, city, state) and must exist exactly once.
+    Shows that overlap another Show of their Venue or Artist are rejected.
+
+In CSV files, genres are separated by ";" and booleans are true/false, 1/0 or yes/no.
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+
+import click
+import dateutil.parser
+from datetime import timedelta
+from sqlalchemy import and_, func, or_, tuple_
+from sqlalchemy.exc import DBAPIError
+
+import counters
+import similar
+import stats
+from models import Venue, Show, Artist, app, db
+
+#----------------------------------------------------------------------------#
+# Reading & Converting Records.
+#----------------------------------------------------------------------------#
+
+def read_records(path, file_format):
+    '''Yields (record number, record, error) for every record of a file
+
+    * Input:
+        - <string> path
+        - <string> file_format: "csv" or "ndjson"
+    * Output: generator of tuples, error is None or the reason why a record could not be read
+    '''
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            for number, record in enumerate(csv.DictReader(file), start=1):
+                yield number, record, None
+        else:
+            for number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line), None
+                except ValueError as error:
+                    yield number, line, 'invalid JSON: {}'.format(error)
+
+def text(record, key, required=False):
+    '''Returns a stripped string value of a record, None for empty values'''
+    value = record.get(key)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise ValueError('{} is required'.format(key))
+        return None
+    return str(value).strip()
+
+def flag(record, key):
+    '''Returns a boolean value of a record'''
+    value = record.get(key)
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+def genre_list(record):
+    '''Returns the genres of a record as list, from a JSON list or a ";" separated string'''
+    value = record.get('genres')
+    if isinstance(value, list):
+        return [str(genre).strip() for genre in value if str(genre).strip()]
+    return [genre.strip() for genre in str(value or '').split(';') if genre.strip()]
+
+def number(record, key):
+    '''Returns a float value of a record, None for empty values'''
+    value = text(record, key)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError('{} is not a number: {}'.format(key, value))
+
+def count(record, key):
+    '''Returns a non-negative integer value of a record, None for empty values'''
+    value = text(record, key)
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise ValueError('{} is not a non-negative integer: {}'.format(key, value))
+    return int(value)
+
+def timestamp(record, key):
+    '''Returns a datetime value of a record, the key is required'''
+    value = text(record, key, required=True)
+    try:
+        return dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise ValueError('{} is not a valid date and time: {}'.format(key, value))
+
+def venue_row(record):
+    return {
+        'name': text(record, 'name', required=True),
+        'city': text(record, 'city'),
+        'state': text(record, 'state'),
+        'address': text(record, 'address'),
+        'phone': text(record, 'phone'),
+        'image_link': text(record, 'image_link'),
+        'facebook_link': text(record, 'facebook_link'),
+        'genres': genre_list(record),
+        'seeking_talent': flag(record, 'seeking_talent'),
+        'seeking_description': text(record, 'seeking_description'),
+        'latitude': number(record, 'latitude'),
+        'longitude': number(record, 'longitude')
+    }
+
+def artist_row(record):
+    return {
+        'name': text(record, 'name', required=True),
+        'city': text(record, 'city'),
+        'state': text(record, 'state'),
+        'phone': text(record, 'phone'),
+        'image_link': text(record, 'image_link'),
+        'facebook_link': text(record, 'facebook_link'),
+        'genres': genre_list(record),
+        'seeking_venue': flag(record, 'seeking_venue'),
+        'seeking_description': text(record, 'seeking_description')
+    }
+
+def show_row(record):
+    # The natural keys are replaced by ids when the batch is resolved
+    start_time = timestamp(record, 'start_time')
+    if text(record, 'end_time') is None:
+        end_time = start_time + timedelta(hours=app.config['SHOW_DEFAULT_DURATION_HOURS'])
+    else:
+        end_time = timestamp(record, 'end_time')
+        if end_time <= start_time:
+            raise ValueError('end_time must be after start_time')
+    return {
+        'venue_key': (text(record, 'venue_name', required=True), text(record, 'venue_city'), text(record, 'venue_state')),
+        'artist_key': (text(record, 'artist_name', required=True), text(record, 'artist_city'), text(record, 'artist_state')),
+        'start_time': start_time,
+        'end_time': end_time,
+        'capacity': count(record, 'capacity')
+    }
+
+def blank_or_equal(column, value):
+    '''Matches value, or NULL and '' if value is None (NULL = NULL is never true in SQL)'''
+    if value is None:
+        return func.coalesce(column, '') == ''
+    return column == value
+
+def resolve_natural_keys(model, keys):
+    '''Looks up the ids of Venues or Artists by (name, city, state) with one query
+
+    * Input:
+        - <Model> model: Venue or Artist
+        - <set> of (name, city, state) tuples, city and state may be None
+    * Output: <dict> key -> id, None for keys that match more than one row
+
+    Keys with city and state are matched as one row value IN list. Keys without
+    city or state match rows where it is NULL or empty, one condition per key.
+    '''
+    complete = [key for key in keys if None not in key]
+    conditions = [
+        and_(model.name == name, blank_or_equal(model.city, city), blank_or_equal(model.state, state))
+        for name, city, state in keys if city is None or state is None
+    ]
+    if complete:
+        conditions.append(tuple_(model.name, model.city, model.state).in_(complete))
+    if not conditions:
+        return {}
+    ids = {}
+    rows = (db.session.query(model.id, model.name, model.city, model.state)
+        .filter(or_(*conditions)))
+    for row in rows:
+        key = (row.name, row.city or None, row.state or None)
+        ids[key] = None if key in ids else row.id
+    return ids
+
+#----------------------------------------------------------------------------#
+# Import.
+#----------------------------------------------------------------------------#
+
+class CatalogImport:
+    '''One run of the import of a single file
+
+    * Input:
+        - <string> kind: "venues", "artists" or "shows"
+        - <file> rejects: rejected records are written to it as NDJSON
+    '''
+
+    def __init__(self, kind, rejects):
+        self.kind = kind
+        self.rejects = rejects
+        self.imported = 0
+        self.rejected = 0
+
+    def reject(self, number, record, reason):
+        self.rejected += 1
+        self.rejects.write(json.dumps({'record': number, 'reason': reason, 'data': record}, default=str) + '\n')
+
+    def convert(self, number, record):
+        '''Converts a record into a row, rejects it and returns None if it is invalid'''
+        try:
+            if self.kind == 'venues':
+                return venue_row(record)
+            if self.kind == 'artists':
+                return artist_row(record)
+            return show_row(record)
+        except (ValueError, AttributeError) as error:
+            # AttributeError: a NDJSON line that is not an object
+            self.reject(number, record, str(error))
+            return None
+
+    def resolve_shows(self, batch):
+        '''Replaces the natural keys of a batch of Shows by ids, rejects unresolved Shows'''
+        venue_ids = resolve_natural_keys(Venue, {row['venue_key'] for _, _, row in batch})
+        artist_ids = resolve_natural_keys(Artist, {row['artist_key'] for _, _, row in batch})
+        resolved = []
+        for number, record, row in batch:
+            venue_id = venue_ids.get(row['venue_key'])
+            artist_id = artist_ids.get(row['artist_key'])
+            if venue_id is None:
+                self.reject(number, record, 'venue not found or not unique: {}'.format(row['venue_key']))
+            elif artist_id is None:
+                self.reject(number, record, 'artist not found or not unique: {}'.format(row['artist_key']))
+            else:
+                resolved.append((number, record, {
+                    'Venue_id': venue_id,
+                    'Artist_id': artist_id,
+                    'start_time': row['start_time'],
+                    'end_time': row['end_time'],
+                    'capacity': row['capacity']
+                }))
+        return resolved
+
+    def insert(self, batch):
+        '''Inserts a batch with one executemany
+
+        With executemany_mode "values" (see config.py) psycopg2 sends the batch as
+        multi-row INSERTs of up to 1000 rows each, not one statement per row.
+        If the database refuses the batch, e.g. because a Show overlaps another
+        one, it is inserted again row by row, each within a savepoint, and only
+        the refused rows are rejected.
+        '''
+        if self.kind == 'shows':
+            batch = self.resolve_shows(batch)
+        if not batch:
+            return
+        table = {'venues': Venue, 'artists': Artist, 'shows': Show}[self.kind].__table__
+
+        try:
+            rows = [row for _, _, row in batch]
+            db.session.execute(table.insert(), rows)
+            self.after_insert(rows)
+            db.session.commit()
+            self.imported += len(rows)
+            return
+        except DBAPIError:
+            db.session.rollback()
+
+        rows = []
+        for number, record, row in batch:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert(), [row])
+                rows.append(row)
+            except DBAPIError as error:
+                self.reject(number, record, str(error.orig).strip())
+        self.after_insert(rows)
+        db.session.commit()
+        self.imported += len(rows)
+
+    def after_insert(self, rows):
+        # executemany bypasses the ORM events that maintain the Show counters, rollup and stale Artists
+        if self.kind == 'shows' and rows:
+            counters.count_inserted_shows(db.session.connection(), rows)
+            stats.count_inserted_shows(db.session.connection(), rows)
+            similar.mark_stale(db.session.connection(), [row['Artist_id'] for row in rows])
+
+@app.cli.command('import-catalog')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']),
+              help='File format, defaults to the file extension.')
+@click.option('--batch-size', default=5000, show_default=True, help='Number of rows per insert.')
+@click.option('--rejects', type=click.Path(dir_okay=False),
+              help='File for rejected records (NDJSON), defaults to stderr.')
+def import_catalog(kind, path, file_format, batch_size, rejects):
+    '''Imports Venues, Artists or Shows from a CSV or NDJSON file.'''
+    if file_format is None:
+        file_format = 'csv' if os.path.splitext(path)[1].lower() == '.csv' else 'ndjson'
+    rejects_file = open(rejects, 'w', encoding='utf-8') if rejects else sys.stderr
+    run = CatalogImport(kind, rejects_file)
+    started = time.perf_counter()
+
+    try:
+        batch = []
+        for number, record, error in read_records(path, file_format):
+            if error:
+                run.reject(number, record, error)
+                continue
+            row = run.convert(number, record)
+            if row is None:
+                continue
+            batch.append((number, record, row))
+            if len(batch) >= batch_size:
+                run.insert(batch)
+                batch = []
+                elapsed = time.perf_counter() - started
+                click.echo('{} {} imported ({:.0f} rows/sec)'.format(run.imported, kind, run.imported / elapsed))
+        run.insert(batch)
+    finally:
+        if rejects:
+            rejects_file.close()
+
+    elapsed = time.perf_counter() - started
+    click.echo('Done: {} {} imported, {} rejected in {:.1f}s ({:.0f} rows/sec)'.format(
+        run.imported, kind, run.rejected, elapsed, run.imported / elapsed if elapsed else 0))
@@ -0,0 +1,158 @@
+"""
+Contains the in-process caches for rendered HTML.
+
+Every worker process holds its own cache. A write invalidates the cache of the
+worker that handled it; other workers serve their copy until it expires, so
+the TTLs in config.py bound how stale a page can be with several workers.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+
+from models import app
+
+
+class FragmentCache:
+    '''Caches rendered HTML fragments by key and counts hits & misses
+
+    * Input: <int> ttl: seconds until an entry expires
+
+    Entries are removed explicitly by invalidate() whenever the data behind
+    them changes. The TTL is only a safety net for other worker processes.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get_or_render(self, key, render):
+        '''Returns the cached fragment for key, calls render() to create it on a miss
+
+        * Input:
+            - <string> key
+            - <function> render: returns the fragment, only called on a miss
+        * Output: the fragment
+        '''
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self.generations.get(key, 0)
+
+        fragment = render()
+
+        with self.lock:
+            # Do not store a fragment if the key has been invalidated while it was rendered,
+            # it may have been rendered from data that was already outdated.
+            if self.generations.get(key, 0) == generation:
+                self.entries[key] = (fragment, now + self.ttl)
+        return fragment
+
+    def invalidate(self, *keys):
+        '''Removes the entries of the given keys'''
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.generations[key] = self.generations.get(key, 0) + 1
+
+    def stats(self):
+        '''Returns hit & miss counters and the number of cached entries'''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries)
+            }
+
+
+class PageCache:
+    '''Caches rendered pages of single entities (e.g. Venues or Artists)
+
+    * Input:
+        - <int> ttl: seconds until an entry expires
+        - <int> max_entries: least recently used entries beyond this number are dropped
+
+    Entries are keyed by (kind, entity id, version) and hold the variants of a page,
+    e.g. one per locale. Every change of an entity bumps its version, so pages rendered
+    before the change are never served again. A page can also expire at a given point
+    in time, e.g. when the next upcoming Show starts. max_entries counts entities.
+    '''
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = timedelta(seconds=ttl)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def version(self, kind, entity_id):
+        '''Returns the current version of an entity, read it before querying the data of a page'''
+        with self.lock:
+            return self.versions.get((kind, entity_id), 0)
+
+    def get(self, kind, entity_id, variant=None):
+        '''Returns the cached page of an entity or None'''
+        with self.lock:
+            key = (kind, entity_id, self.versions.get((kind, entity_id), 0))
+            entry = self.entries.get(key, {}).get(variant)
+            if entry is not None and entry[1] > datetime.now():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def set(self, kind, entity_id, version, page, expires_at=None, variant=None):
+        '''Stores the page of an entity
+
+        * Input:
+            - <string> kind
+            - <int> entity_id
+            - <int> version: the version read before the data of the page was queried,
+              the page is not stored if the entity changed in the meantime
+            - page: the rendered page
+            - <datetime> expires_at: optional, the entry expires earlier than the TTL
+            - variant: optional, e.g. the locale the page has been rendered in
+        '''
+        expires = datetime.now() + self.ttl
+        if expires_at is not None:
+            expires = min(expires, expires_at)
+        with self.lock:
+            if self.versions.get((kind, entity_id), 0) != version:
+                return
+            self.entries.setdefault((kind, entity_id, version), {})[variant] = (page, expires)
+            self.entries.move_to_end((kind, entity_id, version))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def bump(self, kind, entity_id):
+        '''Marks all cached pages of an entity as outdated'''
+        with self.lock:
+            version = self.versions.get((kind, entity_id), 0)
+            self.entries.pop((kind, entity_id, version), None)
+            self.versions[(kind, entity_id)] = version + 1
+
+    def stats(self):
+        '''Returns hit & miss counters and the number of cached entries'''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'pages': sum(len(variants) for variants in self.entries.values())
+            }
+
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_TTL'])
+page_cache = PageCache(app.config['PAGE_CACHE_TTL'], app.config['PAGE_CACHE_MAX_ENTRIES'])
@@ -0,0 +1,193 @@
+"""
+Keeps the denormalized Show counters on Venue and Artist up to date.
+
+A Show counts as past Show if it started before the last rollover
+(ShowCounterState.rolled_over_at), otherwise as upcoming Show:
+  - Inserting or deleting a Show adjusts the counters of its Venue and Artist
+    within the same transaction.
+  - The rollover job moves all Shows that started since the last rollover from
+    "upcoming" to "past". It should be scheduled, e.g. every minute with cron:
+
+      FLASK_APP=app.py flask rollover-show-counters
+
+  - Shows inserted without the ORM (executemany) are counted by count_inserted_shows().
+  - "flask rebuild-show-counters" recounts everything from the Show table.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from sqlalchemy import bindparam, event, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from archive import show_history
+from models import Venue, Show, Artist, ShowCounterState, app, db
+
+# Id of the single ShowCounterState row (see migration 2b7f0e5c9a18)
+STATE_ID = 1
+
+#----------------------------------------------------------------------------#
+# Show Listeners.
+#----------------------------------------------------------------------------#
+
+def get_rolled_over_at(connection):
+    '''Reads the rollover point in time and locks it until the transaction ends
+
+    * Input: <Connection> connection of the current flush
+    * Output: <datetime> of the last rollover or None
+
+    FOR SHARE lets concurrent Show inserts pass, but makes a running rollover wait
+    until they are committed (and vice versa), so no Show is counted on the wrong side.
+    '''
+    return connection.execute(
+        select([ShowCounterState.rolled_over_at])
+        .where(ShowCounterState.id == STATE_ID)
+        .with_for_update(read=True)
+    ).scalar()
+
+def adjust_counters(connection, show, delta):
+    '''Adds delta to the upcoming or past counter of the Venue and Artist of show
+
+    * Input:
+        - <Connection> connection of the current flush
+        - <Show> show
+        - <int> delta: 1 for an inserted, -1 for a deleted Show
+    '''
+    if show.start_time is None:
+        return
+    rolled_over_at = get_rolled_over_at(connection)
+    if rolled_over_at is not None and show.start_time <= rolled_over_at:
+        column = 'past_shows_count'
+    else:
+        column = 'upcoming_shows_count'
+
+    for model, entity_id in ((Venue, show.Venue_id), (Artist, show.Artist_id)):
+        if entity_id is None:
+            continue
+        table = model.__table__
+        connection.execute(table.update()
+            .where(table.c.id == entity_id)
+            .values({column: table.c[column] + delta}))
+
+def count_inserted_shows(connection, shows):
+    '''Adjusts the counters for Shows that have been inserted without the ORM
+
+    * Input:
+        - <Connection> connection of the transaction that inserted the Shows
+        - <list> of dicts with "Venue_id", "Artist_id" and "start_time"
+
+    Counts are summed up per Venue and Artist first, so every affected row is
+    updated once, with one executemany per table.
+    '''
+    rolled_over_at = get_rolled_over_at(connection)
+    for model, fk in ((Venue, 'Venue_id'), (Artist, 'Artist_id')):
+        deltas = defaultdict(lambda: {'upcoming': 0, 'past': 0})
+        for show in shows:
+            if show[fk] is None or show['start_time'] is None:
+                continue
+            past = rolled_over_at is not None and show['start_time'] <= rolled_over_at
+            deltas[show[fk]]['past' if past else 'upcoming'] += 1
+        if not deltas:
+            continue
+        table = model.__table__
+        connection.execute(table.update()
+            .where(table.c.id == bindparam('entity_id'))
+            .values(
+                upcoming_shows_count=table.c.upcoming_shows_count + bindparam('upcoming'),
+                past_shows_count=table.c.past_shows_count + bindparam('past')),
+            [dict(entity_id=entity_id, **delta) for entity_id, delta in deltas.items()])
+
+@event.listens_for(Show, 'after_insert')
+def show_inserted(mapper, connection, show):
+    adjust_counters(connection, show, 1)
+
+@event.listens_for(Show, 'after_delete')
+def show_deleted(mapper, connection, show):
+    adjust_counters(connection, show, -1)
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+def get_state():
+    '''Returns the locked ShowCounterState row, creates it if it is missing
+
+    The row has a fixed id and is created with ON CONFLICT DO NOTHING, so concurrent
+    first runs lock the same row instead of inserting one each.
+    '''
+    db.session.execute(insert(ShowCounterState.__table__)
+        .values(id=STATE_ID, rolled_over_at=None)
+        .on_conflict_do_nothing(index_elements=['id']))
+    return ShowCounterState.query.filter_by(id=STATE_ID).with_for_update().one()
+
+def rollover(now=None):
+    '''Moves Shows that started since the last rollover from upcoming to past
+
+    * Input: <datetime> now, defaults to the current time
+    * Output: <datetime> the new rollover point in time
+
+    Only Shows within (last rollover, now] are aggregated, the range is served by
+    the index on (start_time, id).
+    '''
+    now = now or datetime.now()
+    state = get_state()
+    started = Show.start_time <= now
+    if state.rolled_over_at is not None:
+        started = started & (Show.start_time > state.rolled_over_at)
+
+    for model, fk in ((Venue, Show.Venue_id), (Artist, Show.Artist_id)):
+        moved = (db.session.query(fk.label('id'), func.count().label('moved'))
+            .filter(started, fk.isnot(None))
+            .group_by(fk)
+            .subquery())
+        table = model.__table__
+        db.session.execute(table.update()
+            .where(table.c.id == moved.c.id)
+            .values(
+                upcoming_shows_count=table.c.upcoming_shows_count - moved.c.moved,
+                past_shows_count=table.c.past_shows_count + moved.c.moved))
+
+    state.rolled_over_at = now
+    db.session.commit()
+    return now
+
+def rebuild(now=None):
+    '''Recounts the upcoming & past Shows of every Venue and Artist from the Show table and the archive
+
+    * Input: <datetime> now, defaults to the current time
+    '''
+    now = now or datetime.now()
+    state = get_state()
+    shows = show_history()
+    for model, fk in ((Venue, shows.Venue_id), (Artist, shows.Artist_id)):
+        counts = (db.session.query(
+            fk.label('id'),
+            func.count().filter(shows.start_time > now).label('upcoming'),
+            func.count().filter(shows.start_time <= now).label('past'))
+            .filter(fk.isnot(None))
+            .group_by(fk)
+            .subquery())
+        table = model.__table__
+        db.session.execute(table.update().values(upcoming_shows_count=0, past_shows_count=0))
+        db.session.execute(table.update()
+            .where(table.c.id == counts.c.id)
+            .values(upcoming_shows_count=counts.c.upcoming, past_shows_count=counts.c.past))
+    state.rolled_over_at = now
+    db.session.commit()
+
+#----------------------------------------------------------------------------#
+# CLI Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('rollover-show-counters')
+def rollover_command():
+    '''Moves Shows that have started since the last run from upcoming to past.'''
+    rolled_over_at = rollover()
+    click.echo('Shows until {} are counted as past Shows.'.format(rolled_over_at))
+
+@app.cli.command('rebuild-show-counters')
+def rebuild_command():
+    '''Recounts upcoming & past Shows of all Venues and Artists.'''
+    rebuild()
+    click.echo('Show counters rebuilt.')
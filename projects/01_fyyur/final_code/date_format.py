@@ -0,0 +1,52 @@
+"""
+Contains the cached date & time formatting behind the "datetime" template filter.
+
+babel.dates.format_datetime looks up the locale and the pattern on every call.
+Here patterns are compiled once per format and locales parsed once per name.
+Formatted values are memoized as well (DATETIME_MEMO_SIZE, 0 switches it off),
+because many Shows on a page share their start time.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+
+import babel
+import babel.dates
+
+from models import app
+
+# Named formats of the filter, any other format is used as pattern
+FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
+
+
+@lru_cache(maxsize=128)
+def get_pattern(format):
+    '''Returns the compiled pattern of a named format or pattern'''
+    return babel.dates.parse_pattern(FORMATS.get(format, format))
+
+@lru_cache(maxsize=64)
+def get_locale(name):
+    '''Returns the babel Locale of a name like "en" or "de_DE"'''
+    return babel.Locale.parse(name)
+
+def format_uncached(value, format, locale):
+    if not isinstance(value, datetime):
+        # Anything else (e.g. a date or None for "now") is left to babel
+        return babel.dates.format_datetime(value, FORMATS.get(format, format), locale=locale)
+    return get_pattern(format).apply(value, get_locale(locale))
+
+format_memoized = lru_cache(maxsize=app.config['DATETIME_MEMO_SIZE'])(format_uncached)
+
+def format_datetime(value, format='medium', locale='en'):
+    '''Formats a datetime with a named format ("full", "medium") or pattern in a locale
+
+    * Input:
+        - <datetime> value
+        - <string> format
+        - <string> locale
+    * Output: <string>
+    '''
+    return format_memoized(value, format, locale)
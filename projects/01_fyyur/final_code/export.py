@@ -0,0 +1,121 @@
+"""
+Contains the queries and serializers of the CSV/NDJSON export.
+
+Rows are read from a server side cursor in batches of EXPORT_BATCH_SIZE and
+written to the response chunk by chunk, so memory stays flat no matter how
+many rows are exported. Filters are part of the SQL query. Exports of Shows
+include archived Shows, unless the window starts after the archive horizon.
+"""
+
+import csv
+import io
+import json
+
+from archive import show_source
+from models import Venue, Show, Artist, app, db
+
+def show_columns(shows):
+    '''Returns the exported columns of Shows, from Show or show_history()'''
+    return [
+        shows.id, shows.start_time, shows.end_time, shows.capacity, shows.tickets_sold,
+        Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+        Venue.city.label('venue_city'), Venue.state.label('venue_state'),
+        Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+        Artist.city.label('artist_city'), Artist.state.label('artist_state')
+    ]
+
+# Columns of every export, in the order of the CSV header
+EXPORT_COLUMNS = {
+    'venues': [
+        Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.phone,
+        Venue.image_link, Venue.facebook_link, Venue.genres, Venue.seeking_talent,
+        Venue.seeking_description, Venue.latitude, Venue.longitude
+    ],
+    'artists': [
+        Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone,
+        Artist.image_link, Artist.facebook_link, Artist.genres, Artist.seeking_venue,
+        Artist.seeking_description
+    ],
+    'shows': show_columns(Show)
+}
+
+# Size of a response chunk in characters
+CHUNK_SIZE = 64 * 1024
+
+
+def export_query(kind, start=None, end=None, city=None):
+    '''Builds the query of an export
+
+    * Input:
+        - <string> kind: "venues", "artists" or "shows"
+        - <datetime> start, end: Shows starting within [start, end), only for "shows"
+        - <string> city: city of the Venue/Artist; of the Venue for "shows"
+    * Output: <Query> sorted by id (by start_time for Shows), read through a server side cursor
+    '''
+    if kind == 'shows':
+        shows = show_source(start)
+        query = db.session.query(*show_columns(shows))
+    else:
+        query = db.session.query(*EXPORT_COLUMNS[kind])
+    if kind == 'venues':
+        query = query.order_by(Venue.id)
+        if city:
+            query = query.filter(Venue.city == city)
+    elif kind == 'artists':
+        query = query.order_by(Artist.id)
+        if city:
+            query = query.filter(Artist.city == city)
+    else:
+        query = (query
+            .select_from(shows)
+            .join(Venue, Venue.id == shows.Venue_id)
+            .join(Artist, Artist.id == shows.Artist_id)
+            .order_by(shows.start_time, shows.id))
+        if start:
+            query = query.filter(shows.start_time >= start)
+        if end:
+            query = query.filter(shows.start_time < end)
+        if city:
+            query = query.filter(Venue.city == city)
+    # stream_results makes psycopg2 use a named (server side) cursor,
+    # yield_per fetches and converts the rows batch by batch
+    return query.execution_options(stream_results=True).yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+def column_names(kind):
+    return [column.key for column in EXPORT_COLUMNS[kind]]
+
+def csv_value(value):
+    '''Formats a value like the CSV files of the bulk import expect it'''
+    if isinstance(value, list):
+        return ';'.join(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def csv_chunks(kind, rows):
+    '''Yields the header and rows of an export as CSV, in chunks of about CHUNK_SIZE'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column_names(kind))
+    for row in rows:
+        writer.writerow([csv_value(value) for value in row])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_chunks(kind, rows):
+    '''Yields the rows of an export as NDJSON, one object per line, in chunks of about CHUNK_SIZE'''
+    names = column_names(kind)
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(names, row)), default=csv_value) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    yield ''.join(lines)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, FloatField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, NumberRange, ValidationError
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -15,6 +15,22 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    end_time = DateTimeField(
+        # Optional, defaults to SHOW_DEFAULT_DURATION_HOURS after the start
+        'end_time',
+        validators=[Optional()]
+    )
+
+    capacity = IntegerField(
+        # Optional, Shows without capacity are not on sale
+        'capacity',
+        validators=[Optional(), NumberRange(min=0)]
+    )
+
+    def validate_end_time(self, field):
+        # An unparseable end time leaves data None, DateTimeField has reported it already
+        if field.data is not None and self.start_time.data is not None and field.data <= self.start_time.data:
+            raise ValidationError('End time must be after the start time.')
 
 class VenueForm(Form):
     name = StringField(
@@ -116,6 +132,12 @@ class VenueForm(Form):
     facebook_link = StringField(
         'facebook_link', validators=[URL()]
     )
+    latitude = FloatField(
+        'latitude', validators=[Optional(), NumberRange(min=-90, max=90)]
+    )
+    longitude = FloatField(
+        'longitude', validators=[Optional(), NumberRange(min=-180, max=180)]
+    )
 
 class ArtistForm(Form):
     name = StringField(
@@ -0,0 +1,92 @@
+"""
+Contains the per request SQL instrumentation.
+
+Counts the statements and the database time of every request, flags statements
+that are executed repeatedly within one request as likely N+1 patterns, adds a
+Server-Timing header and logs one structured line (JSON) per request.
+
+Switched on and off with SQL_INSTRUMENTATION in config.py. Queries of streamed
+responses (e.g. /shows) run after the headers have been sent and are not counted.
+"""
+
+import json
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if not has_request_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+    stats['count'] += 1
+    stats['time'] += elapsed
+    # Statements contain placeholders instead of values, so the same query
+    # for different ids (the typical N+1 pattern) has the same text.
+    stats['statements'][statement] += 1
+
+def handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute, drop its start time
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start_time'):
+        connection.info['query_start_time'].pop()
+
+def start_request():
+    g.sql_stats = {
+        'count': 0,
+        'time': 0.0,
+        'statements': Counter()
+    }
+
+def init_instrumentation(app, db):
+    '''Registers the engine events and request hooks, if SQL_INSTRUMENTATION is set
+
+    * Input:
+        - <Flask> app
+        - <SQLAlchemy> db
+    '''
+    if not app.config.get('SQL_INSTRUMENTATION'):
+        return
+    threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+
+    def finish_request(response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        db_ms = stats['time'] * 1000
+        repeated = [
+            {'statement': statement, 'count': count}
+            for statement, count in stats['statements'].most_common()
+            if count >= threshold
+        ]
+        response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(db_ms, stats['count']))
+        record = json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'queries': stats['count'],
+            'db_ms': round(db_ms, 2),
+            'n_plus_one': repeated
+        })
+        if repeated:
+            app.logger.warning('sql %s', record)
+        else:
+            app.logger.info('sql %s', record)
+        return response
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    app.before_request(start_request)
+    app.after_request(finish_request)
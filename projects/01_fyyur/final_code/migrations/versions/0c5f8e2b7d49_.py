@@ -0,0 +1,45 @@
+"""show archive
+
+Revision ID: 0c5f8e2b7d49
+Revises: 4b9c1e7d2a30
+Create Date: 2026-10-17 17:26:41.360922
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c5f8e2b7d49'
+down_revision = '4b9c1e7d2a30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Past Shows are moved here by "flask archive-shows", they keep their id
+    op.create_table('ShowArchive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('Venue_id', sa.Integer(), nullable=True),
+        sa.Column('Artist_id', sa.Integer(), nullable=True),
+        sa.Column('start_time', sa.DateTime(), nullable=False),
+        sa.Column('end_time', sa.DateTime(), nullable=False),
+        sa.Column('capacity', sa.Integer(), nullable=True),
+        sa.Column('tickets_sold', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['Artist_id'], ['Artist.id'], ),
+        sa.ForeignKeyConstraint(['Venue_id'], ['Venue.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_show_archive_venue_id_start_time', 'ShowArchive', ['Venue_id', 'start_time'], unique=False)
+    op.create_index('ix_show_archive_artist_id_start_time', 'ShowArchive', ['Artist_id', 'start_time'], unique=False)
+    op.create_index('ix_show_archive_start_time_id', 'ShowArchive', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    # Move archived Shows back, so no Show is lost
+    op.execute('INSERT INTO "Show" (id, "Venue_id", "Artist_id", start_time, end_time, capacity, tickets_sold) '
+               'SELECT id, "Venue_id", "Artist_id", start_time, end_time, capacity, tickets_sold FROM "ShowArchive"')
+    op.drop_index('ix_show_archive_start_time_id', table_name='ShowArchive')
+    op.drop_index('ix_show_archive_artist_id_start_time', table_name='ShowArchive')
+    op.drop_index('ix_show_archive_venue_id_start_time', table_name='ShowArchive')
+    op.drop_table('ShowArchive')
@@ -0,0 +1,76 @@
+"""show end time and booking exclusion constraints
+
+Revision ID: 1d7e5a3c9b64
+Revises: 6f0d4b2a8c15
+Create Date: 2026-10-17 16:12:54.093871
+
+"""
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d7e5a3c9b64'
+down_revision = '6f0d4b2a8c15'
+branch_labels = None
+depends_on = None
+
+# Range of Show ids that get their end time per UPDATE while backfilling
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    # btree_gist provides the "=" operator on integers for GiST indexes
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    # Nullable and without default first: this only touches the catalog, the table is not rewritten
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+
+    # Everything below runs outside of a transaction, like migration 9d2e6b1a0c47: the backfill
+    # commits batch by batch and every ALTER TABLE holds its lock only for its own statement.
+    with op.get_context().autocommit_block():
+        # Existing Shows get the default duration of SHOW_DEFAULT_DURATION_HOURS. Shows without
+        # start time are left alone, they make the NOT NULL checks below fail and have to be fixed first.
+        # Batches walk consecutive id ranges through the primary key, so no batch rescans the
+        # rows of the batches before it.
+        bind = op.get_bind()
+        backfill = sa.text(
+            'UPDATE "Show" SET end_time = start_time + make_interval(hours => :hours) '
+            'WHERE id > :after AND id <= :until AND end_time IS NULL AND start_time IS NOT NULL')
+        hours = current_app.config['SHOW_DEFAULT_DURATION_HOURS']
+        last_id = bind.execute(sa.text('SELECT max(id) FROM "Show"')).scalar() or 0
+        for after in range(0, last_id, BATCH_SIZE):
+            bind.execute(backfill, hours=hours, after=after, until=after + BATCH_SIZE)
+        # Shows inserted meanwhile by code that does not set the end time yet
+        bind.execute(backfill, hours=hours, after=last_id, until=2 ** 31 - 1)
+
+        # Constraints are added NOT VALID (no scan, brief lock) and validated with a lock that still
+        # allows reads and writes. SET NOT NULL skips its scan when a validated CHECK proves it.
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT ck_show_end_after_start CHECK (end_time > start_time) NOT VALID')
+        op.execute('ALTER TABLE "Show" VALIDATE CONSTRAINT ck_show_end_after_start')
+        for column in ('start_time', 'end_time'):
+            op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_{0}_not_null" CHECK ({0} IS NOT NULL) NOT VALID'.format(column))
+            op.execute('ALTER TABLE "Show" VALIDATE CONSTRAINT "Show_{0}_not_null"'.format(column))
+            op.alter_column('Show', column, existing_type=sa.DateTime(), nullable=False)
+            op.drop_constraint('Show_{}_not_null'.format(column), 'Show', type_='check')
+
+        # No two Shows of a Venue (of an Artist) may overlap. Ranges are half open, a Show may
+        # start when the previous one ends. Every insert is checked through the GiST index of the
+        # constraint, so the check stays logarithmic in the number of Shows.
+        # Lock window: Postgres can neither add an exclusion constraint NOT VALID nor attach an index
+        # built concurrently, so each statement builds its GiST index while holding ACCESS EXCLUSIVE
+        # on Show. Reads and writes of Show wait for the duration of one index build (roughly as long
+        # as a CREATE INDEX over all Shows); run the upgrade at a quiet time on large tables.
+        # Fails with the conflicting rows if existing Shows overlap already, they have to be fixed first.
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT ex_show_venue_overlap '
+                   'EXCLUDE USING gist ("Venue_id" WITH =, tsrange(start_time, end_time) WITH &&)')
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT ex_show_artist_overlap '
+                   'EXCLUDE USING gist ("Artist_id" WITH =, tsrange(start_time, end_time) WITH &&)')
+
+
+def downgrade():
+    op.drop_constraint('ex_show_artist_overlap', 'Show')
+    op.drop_constraint('ex_show_venue_overlap', 'Show')
+    op.drop_constraint('ck_show_end_after_start', 'Show')
+    op.alter_column('Show', 'start_time', existing_type=sa.DateTime(), nullable=True)
+    op.drop_column('Show', 'end_time')
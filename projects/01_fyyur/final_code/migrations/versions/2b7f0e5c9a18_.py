@@ -0,0 +1,56 @@
+"""denormalized Show counters on Venue and Artist
+
+Revision ID: 2b7f0e5c9a18
+Revises: 9d2e6b1a0c47
+Create Date: 2026-10-17 11:26:07.531904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7f0e5c9a18'
+down_revision = '9d2e6b1a0c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A constant server default is stored in the catalog only, no table rewrite is needed (PostgreSQL 11+)
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('ShowCounterState',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_over_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint('id = 1', name='ck_show_counter_state_single_row'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Count all existing Shows and store the point in time they have been counted at
+    op.execute('INSERT INTO "ShowCounterState" (id, rolled_over_at) VALUES (1, now()::timestamp)')
+    for table, fk in (('Venue', 'Venue_id'), ('Artist', 'Artist_id')):
+        op.execute(
+            'UPDATE "{table}" SET '
+            'upcoming_shows_count = counts.upcoming, past_shows_count = counts.past '
+            'FROM (SELECT "{fk}" AS id, '
+            'count(*) FILTER (WHERE start_time > state.rolled_over_at) AS upcoming, '
+            'count(*) FILTER (WHERE start_time <= state.rolled_over_at) AS past '
+            'FROM "Show", "ShowCounterState" state '
+            'WHERE "{fk}" IS NOT NULL GROUP BY "{fk}") AS counts '
+            'WHERE "{table}".id = counts.id'.format(table=table, fk=fk))
+
+    # Range index used by the rollover job
+    with op.get_context().autocommit_block():
+        op.create_index('ix_show_start_time_id', 'Show', ['start_time', 'id'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_show_start_time_id', table_name='Show')
+    op.drop_table('ShowCounterState')
+    for table in ('Artist', 'Venue'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,43 @@
+"""similar artists
+
+Revision ID: 3a6d9f1c8e27
+Revises: 0c5f8e2b7d49
+Create Date: 2026-10-17 18:04:12.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a6d9f1c8e27'
+down_revision = '0c5f8e2b7d49'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('SimilarArtist',
+        sa.Column('Artist_id', sa.Integer(), nullable=False),
+        sa.Column('rank', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('similar_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['Artist_id'], ['Artist.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['similar_id'], ['Artist.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('Artist_id', 'rank')
+    )
+    op.create_index('ix_similar_artist_similar_id', 'SimilarArtist', ['similar_id'], unique=False)
+    op.create_table('StaleArtist',
+        sa.Column('Artist_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+        sa.ForeignKeyConstraint(['Artist_id'], ['Artist.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('Artist_id')
+    )
+    # Existing Artists start stale, the first "flask compute-similar-artists" computes all of them
+    op.execute('INSERT INTO "StaleArtist" ("Artist_id") SELECT id FROM "Artist"')
+
+
+def downgrade():
+    op.drop_table('StaleArtist')
+    op.drop_index('ix_similar_artist_similar_id', table_name='SimilarArtist')
+    op.drop_table('SimilarArtist')
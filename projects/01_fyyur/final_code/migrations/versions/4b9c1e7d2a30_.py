@@ -0,0 +1,51 @@
+"""ticket inventory and holds
+
+Revision ID: 4b9c1e7d2a30
+Revises: 1d7e5a3c9b64
+Create Date: 2026-10-17 16:40:17.528610
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b9c1e7d2a30'
+down_revision = '1d7e5a3c9b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Constant defaults, adding the columns does not rewrite the table. Shows without
+    # capacity are not on sale.
+    op.add_column('Show', sa.Column('capacity', sa.Integer(), nullable=True))
+    op.add_column('Show', sa.Column('tickets_sold', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('Show', sa.Column('tickets_held', sa.Integer(), server_default='0', nullable=False))
+    # Last line of defense against overselling, tickets.py never gets close to it
+    op.create_check_constraint('ck_show_tickets_within_capacity', 'Show',
+                               'tickets_sold >= 0 AND tickets_held >= 0 AND tickets_sold + tickets_held <= capacity')
+
+    op.create_table('TicketHold',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('token', sa.String(length=32), nullable=False),
+        sa.Column('Show_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['Show_id'], ['Show.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ticket_hold_token', 'TicketHold', ['token'], unique=True)
+    op.create_index('ix_ticket_hold_show_id_expires_at', 'TicketHold', ['Show_id', 'expires_at'], unique=False)
+    op.create_index('ix_ticket_hold_expires_at', 'TicketHold', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_ticket_hold_expires_at', table_name='TicketHold')
+    op.drop_index('ix_ticket_hold_show_id_expires_at', table_name='TicketHold')
+    op.drop_index('ix_ticket_hold_token', table_name='TicketHold')
+    op.drop_table('TicketHold')
+    op.drop_constraint('ck_show_tickets_within_capacity', 'Show')
+    op.drop_column('Show', 'tickets_held')
+    op.drop_column('Show', 'tickets_sold')
+    op.drop_column('Show', 'capacity')
@@ -0,0 +1,35 @@
+"""trigram indexes for name search
+
+Revision ID: 4f1c2a9d7b3e
+Revises: bc8d8903d03f
+Create Date: 2026-10-17 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2a9d7b3e'
+down_revision = 'bc8d8903d03f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CONCURRENTLY does not block writes while the index is built,
+    # but it can not run inside of a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_name_trgm', 'Venue', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+        op.create_index('ix_artist_name_trgm', 'Artist', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_artist_name_trgm', table_name='Artist', postgresql_concurrently=True)
+        op.drop_index('ix_venue_name_trgm', table_name='Venue', postgresql_concurrently=True)
@@ -0,0 +1,30 @@
+"""natural key indexes for the bulk import
+
+Revision ID: 5e8b3f2d6a91
+Revises: 7c3a91d4e2f5
+Create Date: 2026-10-17 14:02:45.771320
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8b3f2d6a91'
+down_revision = '7c3a91d4e2f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serve the lookup of Venues and Artists by (name, city, state) when Shows are imported
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_name_city_state', 'Venue', ['name', 'city', 'state'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_artist_name_city_state', 'Artist', ['name', 'city', 'state'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_artist_name_city_state', table_name='Artist')
+    op.drop_index('ix_venue_name_city_state', table_name='Venue')
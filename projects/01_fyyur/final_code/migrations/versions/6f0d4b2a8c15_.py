@@ -0,0 +1,33 @@
+"""venue coordinates
+
+Revision ID: 6f0d4b2a8c15
+Revises: 8a4c2e6f1b03
+Create Date: 2026-10-17 15:48:30.116254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f0d4b2a8c15'
+down_revision = '8a4c2e6f1b03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nullable columns without default, adding them does not rewrite the table
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+
+    # Bounding box lookups of /venues/near: a range on latitude, longitude is filtered within the index
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_latitude_longitude', 'Venue', ['latitude', 'longitude'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_venue_latitude_longitude', table_name='Venue')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
@@ -0,0 +1,29 @@
+"""Artist index by initial letter and name
+
+Revision ID: 7c3a91d4e2f5
+Revises: 2b7f0e5c9a18
+Create Date: 2026-10-17 12:40:19.006431
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3a91d4e2f5'
+down_revision = '2b7f0e5c9a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves the letter counts and the keyset pages of /artists; it contains every
+    # column of the page, so pages can be read by index only scans.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_artist_initial_name_id', 'Artist',
+                        [sa.text('upper(left(name, 1))'), 'name', 'id'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_artist_initial_name_id', table_name='Artist')
@@ -0,0 +1,30 @@
+"""GIN indexes on genres
+
+Revision ID: 8a4c2e6f1b03
+Revises: 5e8b3f2d6a91
+Create Date: 2026-10-17 15:21:08.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4c2e6f1b03'
+down_revision = '5e8b3f2d6a91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serve the genre filters (genres @> ARRAY[...]) of /venues and /artists
+    with op.get_context().autocommit_block():
+        op.create_index('ix_venue_genres', 'Venue', ['genres'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True)
+        op.create_index('ix_artist_genres', 'Artist', ['genres'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_artist_genres', table_name='Artist')
+    op.drop_index('ix_venue_genres', table_name='Venue')
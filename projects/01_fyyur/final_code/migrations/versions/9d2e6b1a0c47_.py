@@ -0,0 +1,75 @@
+"""Show surrogate key and composite indexes
+
+Revision ID: 9d2e6b1a0c47
+Revises: 4f1c2a9d7b3e
+Create Date: 2026-10-17 10:03:54.118273
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e6b1a0c47'
+down_revision = '4f1c2a9d7b3e'
+branch_labels = None
+depends_on = None
+
+# Number of table pages (8 kB each, roughly 100 Shows) that get their ids per UPDATE while backfilling
+BATCH_PAGES = 100
+# Number of rows per UPDATE of the final pass
+BATCH_SIZE = 10000
+
+
+def upgrade():
+    # Add the key nullable and without a volatile default first: this only touches the catalog
+    # and does not rewrite the table. New rows get their id from the sequence right away.
+    op.execute('CREATE SEQUENCE "Show_id_seq"')
+    op.add_column('Show', sa.Column('id', sa.Integer(), nullable=True))
+    op.execute('ALTER TABLE "Show" ALTER COLUMN id SET DEFAULT nextval(\'"Show_id_seq"\')')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+
+    # Everything below runs outside of a transaction: the backfill commits batch by batch and
+    # CREATE INDEX CONCURRENTLY does not block inserts while the indexes are built.
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        # The table has no key yet, so it is walked by physical position: every batch covers the
+        # next range of pages, read with a TID range scan (PostgreSQL 14+), and no batch rescans
+        # the pages before it. Updated rows get their id, so it does not matter where they move.
+        pages = bind.execute(sa.text(
+            'SELECT pg_relation_size(\'"Show"\') / current_setting(\'block_size\')::int')).scalar()
+        backfill_pages = sa.text(
+            'UPDATE "Show" SET id = nextval(\'"Show_id_seq"\') '
+            'WHERE ctid >= (\'(\' || :first || \',0)\')::tid AND ctid < (\'(\' || :last || \',0)\')::tid '
+            'AND id IS NULL')
+        for first in range(0, pages, BATCH_PAGES):
+            bind.execute(backfill_pages, first=first, last=first + BATCH_PAGES)
+        # Rows that a concurrent update has moved behind the scan, usually none
+        backfill_rest = sa.text(
+            'UPDATE "Show" SET id = nextval(\'"Show_id_seq"\') '
+            'WHERE ctid IN (SELECT ctid FROM "Show" WHERE id IS NULL LIMIT :batch_size)')
+        while bind.execute(backfill_rest, batch_size=BATCH_SIZE).rowcount:
+            pass
+
+        op.create_index('Show_pkey', 'Show', ['id'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_show_venue_id_start_time', 'Show', ['Venue_id', 'start_time'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_show_artist_id_start_time', 'Show', ['Artist_id', 'start_time'], unique=False,
+                        postgresql_concurrently=True)
+
+        # SET NOT NULL skips its full table scan (held under an exclusive lock) when a validated
+        # CHECK constraint already proves it. VALIDATE only takes a lock that still allows writes.
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_id_not_null" CHECK (id IS NOT NULL) NOT VALID')
+        op.execute('ALTER TABLE "Show" VALIDATE CONSTRAINT "Show_id_not_null"')
+
+    op.alter_column('Show', 'id', nullable=False)
+    op.drop_constraint('Show_id_not_null', 'Show', type_='check')
+    # Promote the already built unique index, so adding the primary key does not scan the table again
+    op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_pkey" PRIMARY KEY USING INDEX "Show_pkey"')
+
+
+def downgrade():
+    op.drop_index('ix_show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_show_venue_id_start_time', table_name='Show')
+    op.drop_constraint('Show_pkey', 'Show', type_='primary')
+    op.drop_column('Show', 'id')
@@ -0,0 +1,32 @@
+"""show rollup
+
+Revision ID: 9e1b7c4f3d58
+Revises: 3a6d9f1c8e27
+Create Date: 2026-10-17 18:41:55.207814
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e1b7c4f3d58'
+down_revision = '3a6d9f1c8e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by "flask rebuild-show-rollup" after the upgrade, kept up to date by stats.py
+    op.create_table('ShowRollup',
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('city', sa.String(length=120), nullable=False),
+        sa.Column('state', sa.String(length=120), nullable=False),
+        sa.Column('genre', sa.String(), nullable=False),
+        sa.Column('shows', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('month', 'city', 'state', 'genre')
+    )
+
+
+def downgrade():
+    op.drop_table('ShowRollup')
@@ -3,6 +3,7 @@ Contains all Database configuration, models and relationships.
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
 from flask_migrate import Migrate
 from flask_moment import Moment
 from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
@@ -22,15 +23,74 @@ app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False 
 
 # TODO DONE: Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
-# Instead of creating a new Table, the documentation recommends to create a association table
-Show = db.Table('Show', db.Model.metadata,
-    db.Column('Venue_id', db.Integer, db.ForeignKey('Venue.id')),
-    db.Column('Artist_id', db.Integer, db.ForeignKey('Artist.id')),
-    db.Column('start_time', db.DateTime)
-)
+# Show started as a bare association table. It is a model with a surrogate key now, so single Shows can be
+# addressed, and it carries composite indexes for the per Venue / per Artist lookups by start_time (see migration 9d2e6b1a0c47).
+class Show(db.Model):
+    __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'Venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'Artist_id', 'start_time'),
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+        db.CheckConstraint('end_time > start_time', name='ck_show_end_after_start'),
+        # No two Shows of a Venue (of an Artist) may overlap, ranges are half open (see migration 1d7e5a3c9b64)
+        ExcludeConstraint(('Venue_id', '='), (db.text('tsrange(start_time, end_time)'), '&&'),
+                          name='ex_show_venue_overlap', using='gist'),
+        ExcludeConstraint(('Artist_id', '='), (db.text('tsrange(start_time, end_time)'), '&&'),
+                          name='ex_show_artist_overlap', using='gist'),
+        db.CheckConstraint('tickets_sold >= 0 AND tickets_held >= 0 AND tickets_sold + tickets_held <= capacity',
+                           name='ck_show_tickets_within_capacity'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    Venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'))
+    Artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'))
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    # Ticket inventory, changed by tickets.py only. Shows without capacity are not on sale.
+    capacity = db.Column(db.Integer)
+    tickets_sold = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    tickets_held = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return 'Show Id:{} | Venue Id: {} | Artist Id: {} | Start: {} | End: {}'.format(self.id, self.Venue_id, self.Artist_id, self.start_time, self.end_time)
+
+class ShowArchive(db.Model):
+    __tablename__ = 'ShowArchive'
+    # Shows that ended long ago, moved out of Show by archive.py, so queries of
+    # upcoming and recent Shows only touch the small Show table. Rows keep their id.
+    __table_args__ = (
+        db.Index('ix_show_archive_venue_id_start_time', 'Venue_id', 'start_time'),
+        db.Index('ix_show_archive_artist_id_start_time', 'Artist_id', 'start_time'),
+        db.Index('ix_show_archive_start_time_id', 'start_time', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    Venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'))
+    Artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'))
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    capacity = db.Column(db.Integer)
+    tickets_sold = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return 'Archived Show Id:{} | Venue Id: {} | Artist Id: {} | Start: {}'.format(self.id, self.Venue_id, self.Artist_id, self.start_time)
+
+# Names of the exclusion constraints of Show, with the model that would be double booked
+SHOW_OVERLAP_CONSTRAINTS = {
+    'ex_show_venue_overlap': 'Venue',
+    'ex_show_artist_overlap': 'Artist'
+}
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        # Trigram index, used by the ILIKE search on names (see migration 4f1c2a9d7b3e)
+        db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # Natural key, used to resolve Venues of imported Shows (see migration 5e8b3f2d6a91)
+        db.Index('ix_venue_name_city_state', 'name', 'city', 'state'),
+        # Genre filters of /venues (see migration 8a4c2e6f1b03)
+        db.Index('ix_venue_genres', 'genres', postgresql_using='gin'),
+        # Bounding box lookups of /venues/near (see migration 6f0d4b2a8c15)
+        db.Index('ix_venue_latitude_longitude', 'latitude', 'longitude'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
@@ -43,12 +103,30 @@ class Venue(db.Model):
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     genres = db.Column(db.ARRAY(db.String())) # To store multiple Genres, I decided to create an Array Column with String as Datatype
     seeking_description = db.Column(db.String(500)) 
-    venues = db.relationship('Artist', secondary=Show, backref=db.backref('shows', lazy='joined'))
+    # Location in degrees (WGS 84), optional
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # Denormalized Show counters, kept up to date by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Read-only shortcut, Shows are written through the Show model. The backref is loaded lazily,
+    # a joined load would pull every Show and Venue into each Artist query.
+    venues = db.relationship('Artist', secondary=Show.__table__, viewonly=True, backref=db.backref('shows', viewonly=True))
     def __repr__(self):
         return 'Venue Id:{} | Name: {}'.format(self.id, self.name)
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        # Trigram index, used by the ILIKE search on names (see migration 4f1c2a9d7b3e)
+        db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # Letter buckets and keyset pages of /artists (see migration 7c3a91d4e2f5)
+        db.Index('ix_artist_initial_name_id', db.text('upper(left(name, 1))'), 'name', 'id'),
+        # Natural key, used to resolve Artists of imported Shows (see migration 5e8b3f2d6a91)
+        db.Index('ix_artist_name_city_state', 'name', 'city', 'state'),
+        # Genre filters of /artists (see migration 8a4c2e6f1b03)
+        db.Index('ix_artist_genres', 'genres', postgresql_using='gin'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
@@ -60,6 +138,82 @@ class Artist(db.Model):
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     genres = db.Column(db.ARRAY(db.String())) # To store multiple Genres, I decided to create an Array Column with String as Datatype
     seeking_description = db.Column(db.String(500))
+    # Denormalized Show counters, kept up to date by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return 'Artist Id:{} | Name: {}'.format(self.id, self.name)
+
+class SimilarArtist(db.Model):
+    __tablename__ = 'SimilarArtist'
+    __table_args__ = (
+        # Artists that list an Artist, recomputed when that Artist changes
+        db.Index('ix_similar_artist_similar_id', 'similar_id'),
+    )
+    # Top similar Artists of every Artist, precomputed by similar.py. The primary key
+    # (Artist_id, rank) returns the list of an Artist in order with one index scan.
+    Artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    similar_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return 'Similar Artist of Artist Id:{} | Rank: {} | Artist Id: {} | Score: {}'.format(self.Artist_id, self.rank, self.similar_id, self.score)
+
+class StaleArtist(db.Model):
+    __tablename__ = 'StaleArtist'
+    # Artists whose similar Artists must be recomputed, queued when their genres or Shows
+    # change and removed by "flask compute-similar-artists". version counts the changes,
+    # so a run only removes the entries it has seen.
+    Artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    def __repr__(self):
+        return 'Stale Artist Id:{} | Version: {}'.format(self.Artist_id, self.version)
+
+class TicketHold(db.Model):
+    __tablename__ = 'TicketHold'
+    __table_args__ = (
+        db.Index('ix_ticket_hold_token', 'token', unique=True),
+        # Expired holds of one Show, released before it is reported as sold out
+        db.Index('ix_ticket_hold_show_id_expires_at', 'Show_id', 'expires_at'),
+        # Expired holds of all Shows, released by "flask release-expired-holds"
+        db.Index('ix_ticket_hold_expires_at', 'expires_at'),
+    )
+    # Tickets reserved for a buyer until expires_at. The buyer confirms or releases
+    # the hold by its random token, the tickets are counted in Show.tickets_held meanwhile.
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), nullable=False)
+    Show_id = db.Column(db.Integer, db.ForeignKey('Show.id', ondelete='CASCADE'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return 'Ticket Hold Id:{} | Show Id: {} | Quantity: {} | Expires: {}'.format(self.id, self.Show_id, self.quantity, self.expires_at)
+
+class ShowRollup(db.Model):
+    __tablename__ = 'ShowRollup'
+    # Number of Shows per month, Venue city & state and Artist genre, maintained by stats.py.
+    # Every Show is counted once per genre and once under genre "*". Missing cities and states are ''.
+    month = db.Column(db.Date, primary_key=True)
+    city = db.Column(db.String(120), primary_key=True)
+    state = db.Column(db.String(120), primary_key=True)
+    genre = db.Column(db.String, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return 'Show Rollup {} | {}, {} | {}: {}'.format(self.month, self.city, self.state, self.genre, self.shows)
+
+class ShowCounterState(db.Model):
+    __tablename__ = 'ShowCounterState'
+    __table_args__ = (
+        db.CheckConstraint('id = 1', name='ck_show_counter_state_single_row'),
+    )
+    # Single row table, its id is always 1. Shows that started until "rolled_over_at" are counted as past Shows,
+    # all later ones as upcoming Shows. NULL means that nothing has been rolled over yet.
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime)
 
     def __repr__(self):
-        return 'Artist Id:{} | Name: {}'.format(self.id, self.name)
\ No newline at end of file
+        return 'Show Counters rolled over at: {}'.format(self.rolled_over_at)
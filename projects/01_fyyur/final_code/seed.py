@@ -0,0 +1,159 @@
+"""
+Contains the generator of synthetic datasets for benchmarks.
+
+  FLASK_APP=app.py flask seed-catalog --scale 100k --seed 42
+
+Fills the database with one Venue per 100 Shows and one Artist per 50 Shows.
+The same seed always generates the same names, genres and Shows. Shows are
+spread over two years around today, half of them in the past. Within a time
+slot every Venue has one Show and no Artist plays twice, so no bookings overlap.
+
+Use a dedicated database, the generated rows are not removed again.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import func
+
+import counters
+import stats
+from forms import ArtistForm
+from models import Venue, Show, Artist, app, db
+
+SCALES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000
+}
+
+GENRES = [value for value, label in ArtistForm.genres.kwargs['choices']]
+
+CITIES = [
+    ('New York', 'NY'), ('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('Chicago', 'IL'),
+    ('Austin', 'TX'), ('Seattle', 'WA'), ('Nashville', 'TN'), ('New Orleans', 'LA'),
+    ('Portland', 'OR'), ('Denver', 'CO'), ('Boston', 'MA'), ('Atlanta', 'GA')
+]
+
+# Approximate centers of the CITIES, Venues are spread up to CITY_SPREAD degrees around them
+CITY_CENTERS = {
+    'New York': (40.7128, -74.0060), 'San Francisco': (37.7749, -122.4194),
+    'Los Angeles': (34.0522, -118.2437), 'Chicago': (41.8781, -87.6298),
+    'Austin': (30.2672, -97.7431), 'Seattle': (47.6062, -122.3321),
+    'Nashville': (36.1627, -86.7816), 'New Orleans': (29.9511, -90.0715),
+    'Portland': (45.5152, -122.6784), 'Denver': (39.7392, -104.9903),
+    'Boston': (42.3601, -71.0589), 'Atlanta': (33.7490, -84.3880)
+}
+CITY_SPREAD = 0.15
+
+WORDS = [
+    'Blue', 'Red', 'Golden', 'Silver', 'Velvet', 'Electric', 'Midnight', 'Wild', 'Lonely',
+    'Crystal', 'Iron', 'Neon', 'Happy', 'Broken', 'Secret', 'Royal', 'Little', 'Big',
+    'Moon', 'Sun', 'River', 'Garden', 'Hall', 'Club', 'Lounge', 'Cellar', 'Station',
+    'Hop', 'Sax', 'Band', 'Petals', 'Hearts', 'Wolves', 'Tigers', 'Echoes', 'Keys'
+]
+
+# Duration of a Show, a time slot must fit a Show
+SHOW_LENGTH = timedelta(hours=3)
+SLOT_LENGTH = timedelta(hours=4)
+BATCH_SIZE = 10000
+CAPACITIES = [None, 100, 250, 500, 1000, 5000]
+
+
+def entity_name(rng, number):
+    return '{} {} {}'.format(rng.choice(WORDS), rng.choice(WORDS), number)
+
+def insert_in_batches(table, rows):
+    '''Inserts rows from a generator with one executemany per BATCH_SIZE rows'''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+def generate_venues(rng, count):
+    for number in range(count):
+        city, state = rng.choice(CITIES)
+        latitude, longitude = CITY_CENTERS[city]
+        yield {
+            'name': entity_name(rng, number),
+            'city': city,
+            'state': state,
+            'latitude': latitude + rng.uniform(-CITY_SPREAD, CITY_SPREAD),
+            'longitude': longitude + rng.uniform(-CITY_SPREAD, CITY_SPREAD),
+            'address': '{} {} Street'.format(rng.randint(1, 9999), rng.choice(WORDS)),
+            'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+            'genres': rng.sample(GENRES, rng.randint(1, 3)),
+            'seeking_talent': rng.random() < 0.3
+        }
+
+def generate_artists(rng, count):
+    for number in range(count):
+        city, state = rng.choice(CITIES)
+        yield {
+            'name': entity_name(rng, number),
+            'city': city,
+            'state': state,
+            'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+            'genres': rng.sample(GENRES, rng.randint(1, 3)),
+            'seeking_venue': rng.random() < 0.3
+        }
+
+def generate_shows(rng, count, venue_ids, artist_ids):
+    '''Generates Shows slot by slot, every Venue has one Show per slot
+
+    Artists of a slot are the Venue index shifted by a random offset, which is
+    unique within the slot because there are at least as many Artists as Venues.
+    '''
+    slots = -(-count // len(venue_ids)) # ceil division
+    slot_length = max(SLOT_LENGTH, timedelta(days=730) / slots)
+    first_slot = datetime.now().replace(minute=0, second=0, microsecond=0) - slot_length * (slots // 2)
+    generated = 0
+    for slot in range(slots):
+        offset = rng.randrange(len(artist_ids))
+        for index, venue_id in enumerate(venue_ids):
+            if generated == count:
+                return
+            start_time = first_slot + slot_length * slot
+            yield {
+                'Venue_id': venue_id,
+                'Artist_id': artist_ids[(index + offset) % len(artist_ids)],
+                'start_time': start_time,
+                'end_time': start_time + SHOW_LENGTH,
+                'capacity': rng.choice(CAPACITIES)
+            }
+            generated += 1
+
+def new_ids(model, after_id):
+    return [row.id for row in db.session.query(model.id).filter(model.id > after_id).order_by(model.id)]
+
+@app.cli.command('seed-catalog')
+@click.option('--scale', type=click.Choice(sorted(SCALES)), help='Preset number of Shows.')
+@click.option('--shows', type=int, help='Number of Shows, instead of a preset.')
+@click.option('--seed', type=int, default=42, show_default=True, help='Seed of the random generator.')
+def seed_catalog(scale, shows, seed):
+    '''Fills the database with a synthetic dataset of Venues, Artists and Shows.'''
+    shows = shows or SCALES[scale or '1k']
+    venues = max(10, shows // 100)
+    artists = max(venues, shows // 50)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    last_venue_id = db.session.query(func.coalesce(func.max(Venue.id), 0)).scalar()
+    last_artist_id = db.session.query(func.coalesce(func.max(Artist.id), 0)).scalar()
+    insert_in_batches(Venue.__table__, generate_venues(rng, venues))
+    insert_in_batches(Artist.__table__, generate_artists(rng, artists))
+    insert_in_batches(Show.__table__, generate_shows(rng, shows,
+        new_ids(Venue, last_venue_id), new_ids(Artist, last_artist_id)))
+    db.session.commit()
+
+    # Shows have been inserted without the ORM, recount them
+    counters.rebuild()
+    stats.rebuild()
+    click.echo('Seeded {} Venues, {} Artists and {} Shows in {:.1f}s.'.format(
+        venues, artists, shows, time.perf_counter() - started))
@@ -0,0 +1,295 @@
+"""
+Contains the precomputed similar Artists ("You might also like") of the Artist pages.
+
+Every Artist is described by a set of features: its genres and the Venues it has
+played or will play at. Two Artists are as similar as the Jaccard index of their
+sets, shared features / all features of both. The SIMILAR_ARTISTS_TOP_K most similar
+Artists of every Artist are stored in SimilarArtist, so the Artist page reads them
+with one index scan. The job computes them, e.g. every few minutes with cron:
+
+  FLASK_APP=app.py flask compute-similar-artists          # stale Artists only
+  FLASK_APP=app.py flask compute-similar-artists --full   # all Artists, e.g. nightly
+
+Changing the genres of an Artist or adding / deleting one of its Shows queues the
+Artist in StaleArtist. The incremental run recomputes the stale Artists and all Artists
+that list one of them. Artists that a change makes similar to an Artist it is not
+listed by yet, e.g. other Artists of the same Venue, are picked up by the next full run.
+
+With NumPy installed the features are compared block by block with vectorized
+operations, otherwise with plain Python. Both return the same lists, Artists with
+the same score are ranked by id.
+"""
+
+import heapq
+import time
+from collections import Counter, defaultdict
+
+import click
+from sqlalchemy import event, inspect, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from archive import show_history
+from models import Show, Artist, SimilarArtist, StaleArtist, app, db
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SIMILAR = SimilarArtist.__table__
+STALE = StaleArtist.__table__
+
+
+def get_similar_artists(artist_id):
+    '''Returns the stored similar Artists of an Artist
+
+    * Input: <int> artist_id
+    * Output: <list> of rows with "id", "name", "image_link" and "score", most similar first
+
+    Used in following Views:
+        - show_artist
+    '''
+    return (db.session.query(Artist.id, Artist.name, Artist.image_link, SimilarArtist.score)
+        .join(SimilarArtist, SimilarArtist.similar_id == Artist.id)
+        .filter(SimilarArtist.Artist_id == artist_id)
+        .order_by(SimilarArtist.rank)
+        .all())
+
+#----------------------------------------------------------------------------#
+# Stale Artists.
+#----------------------------------------------------------------------------#
+
+def mark_stale(connection, artist_ids):
+    '''Queues Artists, so the next run recomputes their similar Artists
+
+    * Input:
+        - <Connection> connection of the current transaction
+        - <iterable> of Artist ids
+
+    Queued Artists get a new version, see unqueue_stale(). The Artist rows themselves
+    are not updated, so a running job never blocks the writers of Shows.
+    '''
+    artist_ids = sorted({artist_id for artist_id in artist_ids if artist_id is not None})
+    if artist_ids:
+        statement = insert(STALE).values([{'Artist_id': artist_id} for artist_id in artist_ids])
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[STALE.c.Artist_id],
+            set_={'version': STALE.c.version + 1}))
+
+@event.listens_for(Show, 'after_insert')
+def show_inserted(mapper, connection, show):
+    mark_stale(connection, [show.Artist_id])
+
+@event.listens_for(Show, 'after_delete')
+def show_deleted(mapper, connection, show):
+    mark_stale(connection, [show.Artist_id])
+
+@event.listens_for(Artist, 'after_update')
+def artist_updated(mapper, connection, artist):
+    if inspect(artist).attrs.genres.history.has_changes():
+        mark_stale(connection, [artist.id])
+
+def get_stale():
+    '''Returns the queued Artists: <dict> Artist id -> version'''
+    return {row.Artist_id: row.version for row in db.session.execute(select([STALE.c.Artist_id, STALE.c.version]))}
+
+def unqueue_stale(stale, artist_ids):
+    '''Removes computed Artists from the queue. The caller commits.
+
+    * Input:
+        - <dict> stale: Artist id -> version, as returned by get_stale()
+        - <list> of the computed Artist ids
+
+    Only entries with the version read by get_stale() are removed. An Artist that
+    changed meanwhile has a new version and stays queued for the next run.
+    '''
+    seen = [(artist_id, stale[artist_id]) for artist_id in artist_ids if artist_id in stale]
+    if seen:
+        db.session.execute(STALE.delete().where(tuple_(STALE.c.Artist_id, STALE.c.version).in_(seen)))
+
+#----------------------------------------------------------------------------#
+# Similarity.
+#----------------------------------------------------------------------------#
+
+def load_features():
+    '''Returns all Artists with their features
+
+    * Output: (<list> of Artist ids, <list> of <set> of feature numbers), in the same order
+
+    Genres and Venue ids are numbered in one sequence, so a set holds both. Shows of
+    Artists added after the Artists were read are skipped, the next run sees them.
+    '''
+    artist_ids = []
+    features = []
+    numbers = {}
+    for row in db.session.query(Artist.id, Artist.genres).order_by(Artist.id):
+        artist_ids.append(row.id)
+        features.append({numbers.setdefault(('genre', genre), len(numbers)) for genre in row.genres or []})
+    position = {artist_id: index for index, artist_id in enumerate(artist_ids)}
+    shows = show_history()
+    pairs = (db.session.query(shows.Artist_id, shows.Venue_id)
+        .filter(shows.Artist_id.isnot(None), shows.Venue_id.isnot(None))
+        .distinct())
+    for row in pairs:
+        index = position.get(row.Artist_id)
+        if index is not None:
+            features[index].add(numbers.setdefault(('venue', row.Venue_id), len(numbers)))
+    return artist_ids, features
+
+def invert(features):
+    '''Returns the inverted index: feature number -> <list> of Artist positions'''
+    artists = defaultdict(list)
+    for position, artist_features in enumerate(features):
+        for feature in artist_features:
+            artists[feature].append(position)
+    return artists
+
+def top_similar_python(features, rows, top_k, block_size):
+    '''Yields the top_k similar Artists of the Artists at the positions rows
+
+    * Input:
+        - <list> of feature sets of all Artists
+        - <list> of positions of the Artists to compute
+        - <int> top_k
+        - <int> block_size: number of Artists per yielded dict
+    * Output: <dict> position -> <list> of (position, score), most similar first, per block
+
+    Only Artists that share a feature are compared, found through the inverted index.
+    Positions follow the Artist ids, so ties are ranked by id.
+    '''
+    artists = invert(features)
+    for start in range(0, len(rows), block_size):
+        block = {}
+        for row in rows[start:start + block_size]:
+            shared = Counter()
+            for feature in features[row]:
+                shared.update(artists[feature])
+            shared.pop(row, None)
+            scores = ((count / (len(features[row]) + len(features[other]) - count), other)
+                for other, count in shared.items())
+            block[row] = [(other, score) for score, other in
+                heapq.nsmallest(top_k, scores, key=lambda item: (-item[0], item[1]))]
+        yield block
+
+def top_similar_numpy(features, rows, top_k, block_size):
+    '''Same as top_similar_python(), vectorized with NumPy
+
+    The features are a sparse Artist x feature bit matrix. For a block of Artists the
+    shared features with all Artists are counted at once: every (block Artist, feature)
+    pair is expanded to the Artists of the feature and the pairs are summed up with
+    bincount into a dense block x candidates matrix, candidates being the Artists that
+    share a feature with one Artist of the block. Memory grows with block size x
+    candidates, which can be all Artists when genres are shared widely: keep
+    SIMILAR_ARTISTS_BLOCK_SIZE x Artists x 8 bytes well below the available memory.
+
+    The top_k-th score of every row is found with partition. All Artists scoring at
+    least as much are ranked by (score, position) like top_similar_python(), so ties
+    at the boundary are cut the same way.
+    '''
+    artists = invert(features)
+    feature_index = {feature: index for index, feature in enumerate(artists)}
+    # Artists per feature in compressed rows: those of feature i are members[offsets[i]:offsets[i + 1]]
+    lengths = numpy.array([len(members) for members in artists.values()], dtype=numpy.int64)
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths)))
+    members = numpy.fromiter((member for members in artists.values() for member in members),
+        dtype=numpy.int64, count=int(offsets[-1]))
+    sizes = numpy.array([len(artist_features) for artist_features in features], dtype=numpy.int64)
+
+    for start in range(0, len(rows), block_size):
+        block = numpy.array(rows[start:start + block_size], dtype=numpy.int64)
+        block_features = numpy.array([feature_index[feature] for row in block for feature in features[row]],
+            dtype=numpy.int64)
+        block_rows = numpy.repeat(numpy.arange(len(block)), sizes[block])
+        pair_lengths = lengths[block_features]
+        # Position of every pair within the members of its feature
+        within = numpy.arange(pair_lengths.sum()) - numpy.repeat(numpy.cumsum(pair_lengths) - pair_lengths, pair_lengths)
+        others = members[numpy.repeat(offsets[block_features], pair_lengths) + within]
+        # Candidates are sorted by position, their columns follow the Artist ids as well
+        candidates, columns = numpy.unique(others, return_inverse=True)
+        shared = numpy.bincount(numpy.repeat(block_rows, pair_lengths) * len(candidates) + columns,
+            minlength=len(block) * len(candidates)).reshape(len(block), len(candidates))
+        # Every candidate has a feature, so the union is at least 1
+        scores = shared / (sizes[block][:, None] + sizes[candidates][None, :] - shared)
+        del shared
+        # An Artist is not similar to itself
+        own = numpy.searchsorted(candidates, block)
+        is_candidate = own < len(candidates)
+        is_candidate[is_candidate] = candidates[own[is_candidate]] == block[is_candidate]
+        scores[numpy.flatnonzero(is_candidate), own[is_candidate]] = 0
+        block_top = {}
+        if len(candidates):
+            kth = min(top_k, len(candidates)) - 1
+            threshold = -numpy.partition(-scores, kth, axis=1)[:, kth]
+        for index, row in enumerate(block):
+            if not len(candidates):
+                block_top[int(row)] = []
+                continue
+            top = numpy.flatnonzero((scores[index] >= threshold[index]) & (scores[index] > 0))
+            # lexsort sorts by the last key first: score descending, then position
+            ranked = top[numpy.lexsort((top, -scores[index, top]))][:top_k]
+            block_top[int(row)] = [(int(candidates[column]), float(scores[index, column])) for column in ranked]
+        yield block_top
+
+def store(block, artist_ids):
+    '''Replaces the stored similar Artists of a block. The caller commits.'''
+    if not block:
+        return
+    db.session.execute(SIMILAR.delete().where(SIMILAR.c.Artist_id.in_([artist_ids[row] for row in block])))
+    rows = [{'Artist_id': artist_ids[row], 'rank': rank, 'similar_id': artist_ids[other], 'score': score}
+        for row, similar in block.items()
+        for rank, (other, score) in enumerate(similar, start=1)]
+    if rows:
+        db.session.execute(SIMILAR.insert(), rows)
+
+def compute(full=False, top_k=None, block_size=None, vectorized=None):
+    '''Computes and stores the similar Artists of all or of the stale Artists
+
+    * Input:
+        - <bool> full: all Artists, otherwise the stale Artists and the Artists listing them
+        - <int> top_k, block_size: optional, default to the config
+        - <bool> vectorized: optional, defaults to whether NumPy is installed
+    * Output: <int> number of computed Artists
+
+    Every block is committed on its own, together with the removal of its Artists
+    from the stale queue. A failed run leaves the remaining Artists queued.
+    '''
+    top_k = top_k or app.config['SIMILAR_ARTISTS_TOP_K']
+    block_size = block_size or app.config['SIMILAR_ARTISTS_BLOCK_SIZE']
+    vectorized = numpy is not None if vectorized is None else vectorized
+    stale = get_stale()
+    if not full and not stale:
+        return 0
+    artist_ids, features = load_features()
+    if full:
+        rows = list(range(len(artist_ids)))
+    else:
+        # The lists that contain a stale Artist may change as well
+        listing = db.session.execute(select([SIMILAR.c.Artist_id])
+            .where(SIMILAR.c.similar_id.in_(list(stale)))
+            .distinct())
+        changed = set(stale) | {row.Artist_id for row in listing}
+        rows = [row for row, artist_id in enumerate(artist_ids) if artist_id in changed]
+    # Ends the reading transaction, the computation keeps nothing open
+    db.session.commit()
+    top_similar = top_similar_numpy if vectorized else top_similar_python
+    for block in top_similar(features, rows, top_k, block_size):
+        store(block, artist_ids)
+        unqueue_stale(stale, [artist_ids[row] for row in block])
+        db.session.commit()
+    return len(rows)
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('compute-similar-artists')
+@click.option('--full', is_flag=True, help='Recompute all Artists instead of the stale ones.')
+@click.option('--top-k', type=int, help='Similar Artists per Artist, defaults to SIMILAR_ARTISTS_TOP_K.')
+@click.option('--block-size', type=int, help='Artists per block, defaults to SIMILAR_ARTISTS_BLOCK_SIZE.')
+@click.option('--python', 'plain', is_flag=True, help='Use plain Python even if NumPy is installed.')
+def compute_similar_artists_command(full, top_k, block_size, plain):
+    '''Computes the similar Artists shown on the Artist pages.'''
+    started = time.perf_counter()
+    computed = compute(full, top_k, block_size, vectorized=False if plain else None)
+    click.echo('Computed similar Artists of {} Artists in {:.1f}s ({}).'.format(
+        computed, time.perf_counter() - started, 'Python' if plain or numpy is None else 'NumPy'))
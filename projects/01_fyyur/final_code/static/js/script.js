@@ -2,3 +2,36 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Typeahead pickers: an input with data-typeahead="venues|artists" suggests names from
+// /typeahead/<kind> and writes the id of the chosen name into the field data-target.
+Array.prototype.forEach.call(document.querySelectorAll('[data-typeahead]'), function (input) {
+  var suggestions = document.getElementById(input.getAttribute('list'));
+  var target = document.getElementById(input.getAttribute('data-target'));
+  var timer = null;
+
+  input.addEventListener('input', function () {
+    var chosen = Array.prototype.find.call(suggestions.options, function (option) {
+      return option.value === input.value;
+    });
+    if (chosen) {
+      target.value = chosen.getAttribute('data-id');
+      return;
+    }
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      fetch('/typeahead/' + input.getAttribute('data-typeahead') + '?q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          suggestions.innerHTML = '';
+          data.results.forEach(function (result) {
+            var option = document.createElement('option');
+            // Names are not unique, the id tells them apart
+            option.value = result.name + ' #' + result.id;
+            option.setAttribute('data-id', result.id);
+            suggestions.appendChild(option);
+          });
+        });
+    }, 100);
+  });
+});
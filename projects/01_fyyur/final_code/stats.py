@@ -0,0 +1,194 @@
+"""
+Contains the Show rollup behind /stats: number of Shows per month, city, state and genre.
+
+City and state are those of the Venue, genres those of the Artist. A Show is counted
+once for every genre of its Artist and once more under ALL_GENRES, so totals by city
+or state are exact although an Artist can have several genres:
+  - Inserting or deleting a Show adjusts its rollup rows within the same transaction,
+    with one UPSERT.
+  - Shows inserted without the ORM (executemany) are counted by count_inserted_shows().
+  - "flask rebuild-show-rollup" recounts everything in one set-based statement.
+
+Archived Shows stay counted. Changing the genres of an Artist or the city of a Venue
+does not move its past counts, they are corrected by the next rebuild, e.g. every
+night with cron:
+
+  FLASK_APP=app.py flask rebuild-show-rollup
+"""
+
+from collections import Counter
+from datetime import date
+
+import click
+from sqlalchemy import Date, DateTime, Integer, String, bindparam, cast, event, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, array, insert
+
+from archive import show_history
+from models import Venue, Show, Artist, ShowRollup, app, db
+
+VENUE = Venue.__table__
+ARTIST = Artist.__table__
+ROLLUP = ShowRollup.__table__
+KEY = ['month', 'city', 'state', 'genre']
+
+# Genre of the rows that count every Show once
+ALL_GENRES = '*'
+
+
+def rollup_select(shows):
+    '''Returns the rollup rows of Shows: (month, city, state, genre, shows)
+
+    * Input: selectable with "Venue_id", "Artist_id", "start_time" and "weight" (1 per Show, -1 to subtract)
+
+    Rows are sorted by their key, so concurrent UPSERTs lock rollup rows in the same order.
+    '''
+    genres = func.array_append(func.coalesce(ARTIST.c.genres, cast(array([]), ARRAY(String))), literal(ALL_GENRES, String))
+    rows = (select([
+        cast(func.date_trunc('month', shows.c.start_time), Date).label('month'),
+        func.coalesce(VENUE.c.city, '').label('city'),
+        func.coalesce(VENUE.c.state, '').label('state'),
+        func.unnest(genres).label('genre'),
+        shows.c.weight])
+        .select_from(shows
+            .join(VENUE, VENUE.c.id == shows.c.Venue_id)
+            .join(ARTIST, ARTIST.c.id == shows.c.Artist_id))
+        .alias('rows'))
+    key = [rows.c[name] for name in KEY]
+    return (select(key + [func.sum(rows.c.weight).label('shows')])
+        .group_by(*key)
+        .order_by(*key))
+
+def add_to_rollup(shows):
+    '''Returns the UPSERT that adds the rollup rows of Shows to the stored ones'''
+    statement = insert(ROLLUP).from_select(KEY + ['shows'], rollup_select(shows))
+    return statement.on_conflict_do_update(
+        index_elements=KEY,
+        set_={'shows': ROLLUP.c.shows + statement.excluded.shows})
+
+# One Show (or several Shows of the same Venue, Artist and month), given as parameters
+ADJUST = add_to_rollup(select([
+    bindparam('venue_id', type_=Integer).label('Venue_id'),
+    bindparam('artist_id', type_=Integer).label('Artist_id'),
+    bindparam('start_time', type_=DateTime).label('start_time'),
+    bindparam('weight', type_=Integer).label('weight')]).alias('shows'))
+
+def adjust_rollup(connection, show, delta):
+    '''Adds delta to the rollup rows of a Show
+
+    * Input:
+        - <Connection> connection of the current flush
+        - <Show> show
+        - <int> delta: 1 for an inserted, -1 for a deleted Show
+    '''
+    if show.Venue_id is None or show.Artist_id is None or show.start_time is None:
+        return
+    connection.execute(ADJUST, venue_id=show.Venue_id, artist_id=show.Artist_id,
+        start_time=show.start_time, weight=delta)
+
+def count_inserted_shows(connection, shows):
+    '''Adds Shows that have been inserted without the ORM to the rollup
+
+    * Input:
+        - <Connection> connection of the transaction that inserted the Shows
+        - <list> of dicts with "Venue_id", "Artist_id" and "start_time"
+
+    Shows of the same Venue, Artist and month are summed up first, every group is one
+    parameter set of one executemany.
+    '''
+    groups = Counter(
+        (show['Venue_id'], show['Artist_id'], show['start_time'].replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+        for show in shows
+        if show['Venue_id'] is not None and show['Artist_id'] is not None and show['start_time'] is not None)
+    if groups:
+        connection.execute(ADJUST, [
+            {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': month, 'weight': weight}
+            for (venue_id, artist_id, month), weight in sorted(groups.items())])
+
+@event.listens_for(Show, 'after_insert')
+def show_inserted(mapper, connection, show):
+    adjust_rollup(connection, show, 1)
+
+@event.listens_for(Show, 'after_delete')
+def show_deleted(mapper, connection, show):
+    adjust_rollup(connection, show, -1)
+
+def rebuild():
+    '''Recounts the rollup from all Shows, including the archived ones
+
+    The rollup is locked against concurrent UPSERTs until the commit. A Show inserted
+    meanwhile is either seen by the recount or added after the lock is released.
+    '''
+    db.session.execute('LOCK TABLE "ShowRollup" IN EXCLUSIVE MODE')
+    db.session.execute(ROLLUP.delete())
+    shows = show_history()
+    db.session.execute(insert(ROLLUP).from_select(KEY + ['shows'], rollup_select(select([
+        shows.Venue_id, shows.Artist_id, shows.start_time, literal(1).label('weight')]).alias('shows'))))
+    db.session.commit()
+
+#----------------------------------------------------------------------------#
+# Dashboard.
+#----------------------------------------------------------------------------#
+
+def add_months(month, count):
+    '''Returns the first day of the month count months after (or before) month'''
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def month_range(first, last):
+    '''Returns the first days of all months from first to last'''
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return months
+
+def get_stats(by, first, last, state=None, genre=None):
+    '''Returns the number of Shows per month, grouped by city, state or genre
+
+    * Input:
+        - <string> by: "city", "state" or "genre"
+        - <date> first, last: first days of the first and last month
+        - <string> state, genre: optional filters
+    * Output: <dict> with "months" (<list> of dates) and "rows" (<list> of dicts with
+      "name", "counts" per month and "total"), largest total first
+
+    Reads the rollup only, at most (months x cities x genres) rows.
+
+    Used in following Views:
+        - /stats
+    '''
+    group = ROLLUP.c[by]
+    if by == 'city':
+        # Cities of the same name in different states are different cities
+        group = ROLLUP.c.city + ', ' + ROLLUP.c.state
+    query = (select([ROLLUP.c.month, group.label('name'), func.sum(ROLLUP.c.shows).label('shows')])
+        .where(ROLLUP.c.month.between(first, last))
+        .group_by(ROLLUP.c.month, group))
+    if state:
+        query = query.where(ROLLUP.c.state == state)
+    if by == 'genre':
+        query = query.where(ROLLUP.c.genre != ALL_GENRES)
+    if genre or by != 'genre':
+        query = query.where(ROLLUP.c.genre == (genre or ALL_GENRES))
+
+    months = month_range(first, last)
+    rows = {}
+    for row in db.session.execute(query):
+        if row.shows <= 0:
+            continue
+        counts = rows.setdefault(row.name, dict.fromkeys(months, 0))
+        counts[row.month] = row.shows
+    rows = [{'name': name, 'counts': [counts[month] for month in months], 'total': sum(counts.values())}
+        for name, counts in rows.items()]
+    rows.sort(key=lambda row: (-row['total'], row['name']))
+    return {'months': months, 'rows': rows}
+
+#----------------------------------------------------------------------------#
+# CLI Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('rebuild-show-rollup')
+def rebuild_command():
+    '''Recounts the Shows per month, city, state and genre of /stats.'''
+    rebuild()
+    click.echo('Show rollup rebuilt.')
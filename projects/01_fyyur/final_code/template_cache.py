@@ -0,0 +1,57 @@
+"""
+Contains the persistent Jinja bytecode cache and the template warm-up.
+
+Jinja compiles a template to Python code the first time it is rendered in a
+process. With TEMPLATE_BYTECODE_CACHE_DIR set, the compiled bytecode is written
+to that directory and loaded by every later process (and after a restart), so a
+new worker skips the compilation. Templates whose source changes are compiled again.
+
+With TEMPLATE_WARM_UP set, every page and form template is loaded at startup,
+so the first requests of a worker do not pay for loading them. The cache can be
+filled ahead of time, e.g. during a deploy:
+
+  FLASK_APP=app.py flask warm-templates
+"""
+
+import os
+import time
+
+import click
+from jinja2 import FileSystemBytecodeCache
+
+# Templates loaded by the warm-up, relative to templates/
+WARM_UP_FOLDERS = ('layouts/', 'pages/', 'forms/', 'errors/')
+
+
+def warm_templates(app):
+    '''Loads (and compiles, if they are not in the bytecode cache) all page and form templates
+
+    * Input: <Flask> app
+    * Output: <int> number of loaded templates
+    '''
+    names = app.jinja_env.list_templates(
+        filter_func=lambda name: name.startswith(WARM_UP_FOLDERS) and name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def init_template_cache(app):
+    '''Installs the bytecode cache and warms up the templates, as configured in config.py
+
+    * Input: <Flask> app
+    '''
+    directory = app.config.get('TEMPLATE_BYTECODE_CACHE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    if app.config.get('TEMPLATE_WARM_UP'):
+        warm_templates(app)
+
+    @app.cli.command('warm-templates')
+    def warm_templates_command():
+        '''Compiles all page and form templates into the bytecode cache.'''
+        started = time.perf_counter()
+        count = warm_templates(app)
+        click.echo('Loaded {} templates in {:.1f} ms, bytecode cache: {}'.format(
+            count, (time.perf_counter() - started) * 1000, directory or 'disabled'))
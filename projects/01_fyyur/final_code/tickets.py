@@ -0,0 +1,158 @@
+"""
+Contains the ticket inventory of Shows: holds, confirmations and releases.
+
+Every change of the inventory is one conditional UPDATE of the Show row, the
+database checks and changes the numbers in one step. There is no read-modify-write,
+so any number of concurrent buyers can neither oversell a Show nor lose an update:
+  - reserve() holds tickets for TICKET_HOLD_SECONDS, if enough are left.
+  - confirm() turns a hold into sold tickets, unless it has expired.
+  - release() gives the tickets of a hold back.
+  - Expired holds are released by a job, e.g. every minute with cron:
+
+      FLASK_APP=app.py flask release-expired-holds
+
+    A Show that looks sold out releases its own expired holds right away.
+"""
+
+import secrets
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import bindparam, select
+
+from models import Show, TicketHold, app, db
+
+SHOW = Show.__table__
+HOLD = TicketHold.__table__
+
+#----------------------------------------------------------------------------#
+# Inventory.
+#----------------------------------------------------------------------------#
+
+def hold_tickets(show_id, quantity):
+    '''Adds quantity to the held tickets of a Show, if that many are left
+
+    * Output: <bool> whether the tickets are held now
+
+    The row lock of the UPDATE serializes concurrent buyers of a Show. A waiting
+    UPDATE evaluates its condition again on the row the previous one committed.
+    '''
+    return db.session.execute(SHOW.update()
+        .where(SHOW.c.id == show_id)
+        .where(SHOW.c.capacity - SHOW.c.tickets_sold - SHOW.c.tickets_held >= quantity)
+        .values(tickets_held=SHOW.c.tickets_held + quantity)
+        .returning(SHOW.c.id)).first() is not None
+
+def give_back(held, sold=False):
+    '''Removes tickets from the held tickets of Shows
+
+    * Input:
+        - <Counter> Show id -> number of tickets
+        - <bool> sold: the tickets are sold, otherwise they are available again
+    '''
+    values = {'tickets_held': SHOW.c.tickets_held - bindparam('quantity')}
+    if sold:
+        values['tickets_sold'] = SHOW.c.tickets_sold + bindparam('quantity')
+    # Sorted, so concurrent jobs lock the Show rows in the same order and cannot deadlock
+    db.session.execute(SHOW.update().where(SHOW.c.id == bindparam('show_id')).values(values),
+        [{'show_id': show_id, 'quantity': quantity} for show_id, quantity in sorted(held.items())])
+
+def reserve(show_id, quantity, now=None):
+    '''Holds tickets of a Show for TICKET_HOLD_SECONDS
+
+    * Input:
+        - <int> show_id
+        - <int> quantity
+        - <datetime> now: optional, defaults to the current time
+    * Output: <dict> with "token", "show_id", "quantity" and "expires_at",
+      None if not enough tickets are left. The caller commits.
+    '''
+    now = now or datetime.now()
+    if not hold_tickets(show_id, quantity):
+        # Expired holds still count as held until they are released
+        if not release_expired(now, show_id=show_id) or not hold_tickets(show_id, quantity):
+            return None
+    hold = {
+        'token': secrets.token_hex(16),
+        'Show_id': show_id,
+        'quantity': quantity,
+        'expires_at': now + timedelta(seconds=app.config['TICKET_HOLD_SECONDS'])
+    }
+    db.session.execute(HOLD.insert(), hold)
+    return {
+        'token': hold['token'],
+        'show_id': show_id,
+        'quantity': quantity,
+        'expires_at': hold['expires_at']
+    }
+
+def remove_hold(token, now=None):
+    '''Deletes a hold that has not expired yet, returns its (Show_id, quantity) or None'''
+    query = HOLD.delete().where(HOLD.c.token == token)
+    if now is not None:
+        query = query.where(HOLD.c.expires_at > now)
+    return db.session.execute(query.returning(HOLD.c.Show_id, HOLD.c.quantity)).first()
+
+def confirm(token, now=None):
+    '''Turns a hold into sold tickets
+
+    * Output: <dict> with "show_id" and "quantity", None if the hold does not exist or
+      has expired. The caller commits.
+    '''
+    hold = remove_hold(token, now or datetime.now())
+    if hold is None:
+        return None
+    give_back(Counter({hold.Show_id: hold.quantity}), sold=True)
+    return {'show_id': hold.Show_id, 'quantity': hold.quantity}
+
+def release(token):
+    '''Gives the tickets of a hold back, returns False if the hold does not exist. The caller commits.'''
+    hold = remove_hold(token)
+    if hold is None:
+        return False
+    give_back(Counter({hold.Show_id: hold.quantity}))
+    return True
+
+def release_expired(now=None, show_id=None, batch_size=1000):
+    '''Releases up to batch_size expired holds
+
+    * Input:
+        - <datetime> now: optional, defaults to the current time
+        - <int> show_id: optional, only holds of this Show
+        - <int> batch_size
+    * Output: <int> number of released holds. The caller commits.
+
+    Holds locked by another transaction (e.g. a concurrent confirm or job) are skipped.
+    '''
+    expired = select([HOLD.c.id]).where(HOLD.c.expires_at <= (now or datetime.now()))
+    if show_id is not None:
+        expired = expired.where(HOLD.c.Show_id == show_id)
+    expired = expired.limit(batch_size).with_for_update(skip_locked=True)
+    rows = db.session.execute(HOLD.delete()
+        .where(HOLD.c.id.in_(expired))
+        .returning(HOLD.c.Show_id, HOLD.c.quantity)).fetchall()
+    held = Counter()
+    for row in rows:
+        held[row.Show_id] += row.quantity
+    if held:
+        give_back(held)
+    return len(rows)
+
+#----------------------------------------------------------------------------#
+# Jobs.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('release-expired-holds')
+@click.option('--batch-size', default=1000, show_default=True, help='Number of holds per transaction.')
+def release_expired_holds_command(batch_size):
+    '''Releases the tickets of expired holds.'''
+    now = datetime.now()
+    released = 0
+    while True:
+        count = release_expired(now, batch_size=batch_size)
+        db.session.commit()
+        released += count
+        if count < batch_size:
+            break
+    click.echo('Released {} expired holds.'.format(released))
@@ -0,0 +1,119 @@
+"""
+Contains the in-memory prefix indexes of Venue and Artist names for the typeahead.
+
+An index is loaded with one query on its first lookup and kept up to date by the
+views that create, edit or delete Venues and Artists. Lookups never query the
+database. Like the caches in cache.py every worker process holds its own index,
+changes made by other workers (or the bulk import) show up once the index is
+reloaded after TYPEAHEAD_RELOAD_SECONDS.
+"""
+
+import time
+from bisect import bisect_left, insort
+from threading import Lock
+
+from models import Venue, Artist, app, db
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+def index_keys(name):
+    '''Returns the keys of a name: the name itself and every tail starting at a word
+
+    "The Musical Hop" is found by "the m", "musical" and "hop".
+    '''
+    words = normalize(name).split(' ')
+    return {' '.join(words[start:]) for start in range(len(words))}
+
+
+class PrefixIndex:
+    '''Sorted list of (key, name, id) entries, searched by prefix with bisect
+
+    * Input:
+        - <function> load: returns (id, name) rows of all entities
+        - <int> reload_seconds: the index is loaded again after this time
+
+    A lookup costs O(log n) plus the number of returned entries,
+    adding or removing an entity O(n) for moving the list entries.
+    '''
+
+    def __init__(self, load, reload_seconds):
+        self.load = load
+        self.reload_seconds = reload_seconds
+        self.entries = None
+        self.names = {}
+        self.loaded_at = 0
+        self.changes = 0
+        self.lock = Lock()
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.entries is not None and time.monotonic() - self.loaded_at < self.reload_seconds:
+                return
+            changes = self.changes
+        rows = [(row.id, row.name) for row in self.load() if row.name]
+        entries = sorted((key, name, entity_id) for entity_id, name in rows for key in index_keys(name))
+        with self.lock:
+            self.entries = entries
+            self.names = dict(rows)
+            # A change while loading may be missing in the rows, load again on the next lookup
+            self.loaded_at = time.monotonic() if self.changes == changes else 0
+
+    def search(self, prefix, limit):
+        '''Returns up to limit entities whose name or one of its words starts with prefix
+
+        * Input:
+            - <string> prefix
+            - <int> limit
+        * Output: <list> of dicts with "id" and "name", sorted by the matched key
+        '''
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.ensure_loaded()
+        results = []
+        seen = set()
+        with self.lock:
+            position = bisect_left(self.entries, (prefix,))
+            while position < len(self.entries) and len(results) < limit:
+                key, name, entity_id = self.entries[position]
+                if not key.startswith(prefix):
+                    break
+                if entity_id not in seen:
+                    seen.add(entity_id)
+                    results.append({'id': entity_id, 'name': name})
+                position += 1
+        return results
+
+    def add(self, entity_id, name):
+        '''Adds an entity, or updates its name'''
+        with self.lock:
+            self.changes += 1
+            if self.entries is None:
+                return # Not loaded yet, the first lookup loads it
+            self._remove(entity_id)
+            if name:
+                for key in index_keys(name):
+                    insort(self.entries, (key, name, entity_id))
+                self.names[entity_id] = name
+
+    def remove(self, entity_id):
+        '''Removes an entity'''
+        with self.lock:
+            self.changes += 1
+            if self.entries is not None:
+                self._remove(entity_id)
+
+    def _remove(self, entity_id):
+        name = self.names.pop(entity_id, None)
+        if name is None:
+            return
+        for key in index_keys(name):
+            position = bisect_left(self.entries, (key, name, entity_id))
+            if position < len(self.entries) and self.entries[position] == (key, name, entity_id):
+                del self.entries[position]
+
+
+venue_index = PrefixIndex(lambda: db.session.query(Venue.id, Venue.name).all(), app.config['TYPEAHEAD_RELOAD_SECONDS'])
+artist_index = PrefixIndex(lambda: db.session.query(Artist.id, Artist.name).all(), app.config['TYPEAHEAD_RELOAD_SECONDS'])